@@ -5,499 +5,915 @@
 
 # Import Python Modules
 
+import os
+import json
+import pickle
+import hashlib
+import importlib.util
 import time
+import argparse
+import multiprocessing
+from collections import defaultdict
 import numpy as np
 import pandas as pd
 from random import random
 from random import shuffle
+from random import seed
+from random import randrange
+from random import getstate
+from random import setstate
 from ortools.linear_solver import pywraplp
-
-# Import the Input File with the 2022-2023 Student and Course Data.  
-
-InputFile = pd.ExcelFile("WPGA 2022-2023 Data.xlsx") 
-InputMatrix = pd.read_excel(InputFile, "Data") 
-InputInfo = InputMatrix.values.tolist()
-
-# Generate the list of courses and list of students.  Sort both lists.
-# Let n be the number of students and m be the number of courses.
-
-CourseList = []
-for i in range(len(InputInfo)):
-    CourseName = InputInfo[i][1]
-    if not pd.isna(CourseName):
-        if not CourseName in CourseList:
-            CourseList.append(CourseName)
-CourseList.sort()
-
-StudentList = []
-for i in range(len(InputInfo)):
-    StudentID = InputInfo[i][31]
-    if not StudentID in StudentList:
-        StudentList.append(StudentID)
-StudentList.sort()
-
-n = len(StudentList)
-m = len(CourseList)
-
-print("There are", n, "students to be timetabled into", m, "courses")
-
-# For each course j, let CourseSections[j] be the number of sections of that course.
-# For example, CourseSections[15] = 2 since Course #15 (AP Psychology) has 2 sections.
-
-CourseSections = [0 for j in range(m)]
-for j in range(m):
-    CourseName = InputInfo[j][1]
-    NumberOfSections = int(InputInfo[j][5])
-    CourseIndex = CourseList.index(CourseName)
-    CourseSections[CourseIndex] = NumberOfSections
-    
-
-# For each student i, let StudentChoices[i] be the list of courses chosen by that student.
-
-StudentChoices = [ [] for i in range(n)]
-for i in range(len(InputInfo)):
-    StudentID = InputInfo[i][31]
-    StudentIndex = StudentList.index(StudentID)
-    CourseName = InputInfo[i][35]
-    CourseIndex = CourseList.index(CourseName)
-    StudentChoices[StudentIndex].append(CourseIndex)
-
-# Generate the list of forbidden (Course,Block) assignments.  If [j,k] appears in the
-# ForbiddenAssignments list, then no section s of course j can be offered in block k.
-
-ForbiddenAssignments = []
-
-for x in range(m):
-    Requirement = InputInfo[x][8]
-    CourseName = InputInfo[x][1]
-    if not pd.isnull(Requirement):
-        j = CourseList.index(CourseName)
-        if Requirement == '1A/2A':
-            for k in [2,3,4,6,7,8,9]: ForbiddenAssignments.append([j,k])      
-        elif Requirement == '1A/1B':
-            for k in [3,4,5,6,7,8,9]: ForbiddenAssignments.append([j,k])
-        elif Requirement == '1A/1B/2A/2B':
-            for k in [3,4,7,8,9]: ForbiddenAssignments.append([j,k])
-        elif Requirement == '2C/2D/2E':
-            for k in [1,2,3,4,5,6]: ForbiddenAssignments.append([j,k])
-        
-        
-# Generate the list of required (Section,Course,Block) assignments.  If [s,j,k] appears in the
-# RequiredAssignments list, then section s of course j must be offered in block k.
-
-RequiredAssignments = []
-
-for x in range(m):
-    Requirement = InputInfo[x][8]
-    CourseName = InputInfo[x][1]
-    if not pd.isnull(Requirement):
-        j = CourseList.index(CourseName)
-        if Requirement == '1A': RequiredAssignments.append([1,j,1])
-        elif Requirement == '1B': RequiredAssignments.append([1,j,2])
-        elif Requirement == '1C': RequiredAssignments.append([1,j,3])
-        elif Requirement == '1D': RequiredAssignments.append([1,j,4])
-        elif Requirement == '2A': RequiredAssignments.append([1,j,5])
-        elif Requirement == '2B': RequiredAssignments.append([1,j,6])
-
-j= CourseList.index("Study Block")
-for s in [1,2,3,4,5,6,7,8,9]:
-    RequiredAssignments.append([s,j,s])
-    
-j = CourseList.index("Study Block2")
-for s in [1,2,3,4,5,6,7,8,9]:
-    RequiredAssignments.append([s,j,s])
-    
-j = CourseList.index("Supervised Support Block")
-for s in [1,2,3,4,5,6,7,8,9]:
-    RequiredAssignments.append([s,j,s])
-
-# For each course j, let CourseRequestList[j] be the list of students who requested that course.
-# Also, let CourseRequestTotal[j] be the total number of students who requested that course.
-
-CourseRequestList = [ [] for j in range(m)]
-CourseRequestTotal = [ 0 for j in range(m)]
-for i in range(n):
-    for j in StudentChoices[i]:
-        CourseRequestTotal[j] += 1
-        CourseRequestList[j].append(i) 
-        
-
-# For each course j, let CoursePriority[j] be the priority level of that course.
-# In the absence of any other information, assume CoursePriority[j] = 0 for all courses j.
-
-CoursePriority = [0 for j in range(m)]
-
-
-# For each course j, let PossibleTeachers[j] be the list of possible teachers for that course.
-# Leave any commas and slash marks as they are.
-
-PossibleTeachers = [ [] for j in range(m)]
-for j in range(m):
-    CourseName = InputInfo[j][1]
-    CourseIndex = CourseList.index(CourseName)
-    TeacherInfo = InputInfo[j][6]
-    if pd.notna(TeacherInfo):
-        PossibleTeachers[CourseIndex] = TeacherInfo
-        
-
-# From Column N of the Input Excel file, generate the list of teachers and sort this list.
-
-TeacherList = []
-for i in range(len(InputInfo)):
-    TeacherName = InputInfo[i][13]
-    if pd.notna(TeacherName):
-        TeacherList.append(TeacherName)
-TeacherList.sort()
-
-    
-# For each teacher t, let TeacherCourses[t] be the list of courses that MUST be taught
-# by that teacher.  Each course is a number in range(m), based on the index of the course name
-# in the variable CourseList.  For all courses with multiple options separated by slash marks / 
-# (e.g. McAllister/JohnsonCalvert), leave those blank.  Only include courses where there is 
-# one assigned teacher (e.g. Harms) or multiple teachers separated by commas (Bendl, Boland)
-
-TeacherCourses = [ [] for t in range(len(TeacherList))]
-for j in range(m):
-    CourseName = InputInfo[j][1]
-    CourseIndex = CourseList.index(CourseName)
-    TeacherInfo = InputInfo[j][6]
-    if pd.notna(TeacherInfo):
-        TeacherSplit = TeacherInfo.split('/')
-        if len(TeacherSplit) == 1:
-            if TeacherSplit not in [["ANY"], ["PESTAFF"], ["Do not schedule"]]:
-                TeacherName = TeacherSplit[0]
-                if ',' in TeacherName:
-                    AllTeachers = TeacherName.split(', ')
-                    for Teacher in AllTeachers:
-                        t = TeacherList.index(Teacher)
+from ortools.linear_solver import linear_solver_pb2
+
+# Read the input workbook with the much faster calamine engine if python-calamine is installed,
+# and with the default engine (openpyxl) otherwise.
+ExcelEngine = "calamine" if importlib.util.find_spec("python_calamine") is not None else None
+
+# Command-line options for the hill-climbing search.  With no options, the program only solves
+# Iteration 0 for the pre-loaded timetable below.
+
+DefaultInput = "WPGA 2022-2023 Data.xlsx"
+
+# The rules file is kept next to this program, so it is found there whatever the current
+# directory is.  In a notebook, which has no __file__, it is looked for in the current directory.
+ProgramDirectory = os.getcwd()
+if "__file__" in globals():
+    ProgramDirectory = os.path.dirname(os.path.abspath(__file__))
+DefaultRules = os.path.join(ProgramDirectory, "WPGA 2022-2023 Rules.json")
+
+Parser = argparse.ArgumentParser(description="Timetabling Program for West Point Grey Academy")
+Parser.add_argument("--input", default=DefaultInput,
+                    help="input workbook with the course and student data (default: %(default)s)")
+Parser.add_argument("--rules", default=DefaultRules,
+                    help="JSON file with the block, teacher availability, section and capacity "
+                         "rules for the input (default: WPGA 2022-2023 Rules.json next to this "
+                         "program)")
+Parser.add_argument("--iterations", type=int, default=0,
+                    help="maximum number of hill-climbing iterations after Iteration 0")
+Parser.add_argument("--fixed-number", type=int, default=10,
+                    help="number of course sections that are free to move in each iteration")
+Parser.add_argument("--time-budget", type=float, default=0,
+                    help="stop the search after this many seconds of wall-clock time (0 = no limit)")
+Parser.add_argument("--restart-after", type=int, default=0,
+                    help="restart from the pre-loaded timetable after this many iterations "
+                         "without an improvement (0 = never restart)")
+Parser.add_argument("--seed", type=int, default=None, help="seed for the random number generator")
+Parser.add_argument("--workers", type=int, default=1,
+                    help="number of worker processes that solve neighbourhoods in parallel")
+Parser.add_argument("--neighbourhoods", type=int, default=0,
+                    help="number of neighbourhoods to solve in each iteration with --workers "
+                         "(default: twice the number of workers)")
+Parser.add_argument("--no-warm-start", action="store_true",
+                    help="do not start each iteration from the current timetable (on CBC, this "
+                         "only drops the objective lower bound, since CBC takes no hint)")
+Parser.add_argument("--symmetry-breaking", action="store_true",
+                    help="order the interchangeable sections of each course by block")
+Parser.add_argument("--screen-moves", type=int, default=0,
+                    help="free the sections of this many of the most promising single-section "
+                         "moves in each iteration, as estimated by MoveEvaluator")
+Parser.add_argument("--backend", choices=["CBC", "SCIP", "HIGHS", "CP-SAT"], default="CBC",
+                    help="solver used for the Integer Linear Programs")
+Parser.add_argument("--threads", type=int, default=0,
+                    help="number of threads for each solver (default: all cores shared between the "
+                         "workers for CP-SAT, 1 otherwise)")
+Parser.add_argument("--time-limit", type=float, default=0,
+                    help="stop each solve after this many seconds and use the best timetable found "
+                         "so far, if any (0 = no limit)")
+Parser.add_argument("--relative-gap", type=float, default=None,
+                    help="stop each solve once it is within this relative gap of optimal "
+                         "(default: the solver's own setting)")
+Parser.add_argument("--solver-log", action="store_true",
+                    help="print the solver's progress log, including each improving timetable it finds")
+Parser.add_argument("--metrics-log", default=None,
+                    help="append per-phase timings and model sizes to this file as JSON lines")
+Parser.add_argument("--no-input-cache", action="store_true",
+                    help="always parse the input file, and do not read or write its cache")
+Parser.add_argument("--students-output", default="WPGA Optimal Timetable (Students).csv",
+                    help="write the timetable from the perspective of the students to this file, "
+                         "as Parquet if it ends in .parquet and as CSV otherwise")
+Parser.add_argument("--initial", choices=["preloaded", "greedy", "model"], default=None,
+                    help="how to build the Iteration 0 timetable: the pre-loaded 2022-2023 "
+                         "timetable, the greedy constructor, or an Integer Linear Program "
+                         "(default: preloaded for the 2022-2023 data and greedy otherwise)")
+Parser.add_argument("--checkpoint", default="CS5100_Checkpoint.pickle",
+                    help="save the state of the search to this file after every iteration "
+                         "(default: %(default)s)")
+Parser.add_argument("--resume", action="store_true",
+                    help="carry on with the search saved in the checkpoint file instead of "
+                         "starting again from Iteration 0")
+# Arguments that the parser does not know are only tolerated so that the script still runs in a
+# notebook kernel (which passes its own "-f kernel.json").  A misspelled option such as
+# --fixed_number is an error, since the run would otherwise quietly use the default.
+Options, Unknown = Parser.parse_known_args()
+if any(Argument.startswith("--") for Argument in Unknown):
+    Parser.error("unrecognized arguments: " + " ".join(Unknown))
+if Unknown:
+    print("Ignoring the arguments", " ".join(Unknown))
+
+# Writing Parquet files needs pyarrow, so check for it before spending any time on the solve.
+if Options.students_output.endswith(".parquet") and importlib.util.find_spec("pyarrow") is None:
+    Parser.error("--students-output needs the pyarrow package to write Parquet files")
+
+# The pre-loaded timetable and the fixes for the unlucky students below belong to the 2022-2023
+# data, so they are only used if SchoolData is True.  Any other input file (for example, a synthetic
+# instance from benchmarks/generate_instance.py) starts from an empty timetable instead.  The
+# 2022-2023 data is recognized by the SHA-256 hash of the workbook, SchoolDigest, so it does not
+# matter where the file is or which directory the program runs in.
+
+SchoolDigest = "45f77ac32c77f9b3191804289e2808fa9457b017a4e5f9abe27d6e860b285438"
+
+def FileDigest(Path):
+    try:
+        file = open(Path, 'rb')
+        Digest = hashlib.sha256(file.read()).hexdigest()
+        file.close()
+    except OSError:
+        raise SystemExit("ERROR! Could not read " + Path)
+    return Digest
+
+InputDigest = FileDigest(Options.input)
+SchoolData = InputDigest == SchoolDigest
+
+if Options.initial == "preloaded" and not SchoolData:
+    Parser.error("--initial preloaded only works with the 2022-2023 data in " + DefaultInput)
+InitialMethod = Options.initial or ("preloaded" if SchoolData else "greedy")
+
+
+# The rules file (--rules) holds the parts of the timetabling problem that are not in the input
+# workbook, such as the manual changes from Ralph's Excel sheet, as a JSON object with three parts:
+#   "requirement_codes": a course rule for the courses with each Block Requirement code (Column I)
+#   "courses": a course rule for each course, by name
+#   "teachers": {"blocks": [...]} for each teacher, by name: the blocks in which they can teach
+# A course rule can have the keys "blocks" (the blocks in which the course can be offered),
+# "required" (the block of each required section, e.g. {"1": "1B"}), "sections", "capacity"
+# (overrides for the number of sections and RoomLimit), "teachers" (more teachers who must teach
+# the course) and "department".  Blocks are named 1A-2E as in the output, and "note" is ignored.
+# ParseInput compiles the "blocks" rules into boolean block masks, with CompileBlocks.
+
+BlockNumbers = {"1A": 1, "1B": 2, "1C": 3, "1D": 4, "2A": 5, "2B": 6, "2C": 7, "2D": 8, "2E": 9}
+CourseRuleKeys = ["blocks", "required", "sections", "capacity", "teachers", "department", "note"]
+TeacherRuleKeys = ["blocks", "note"]
+
+def LoadRules(RulesPath):
+    try:
+        file = open(RulesPath)
+        Rules = json.load(file)
+        file.close()
+    except OSError:
+        raise SystemExit("ERROR! Could not read the rules file " + RulesPath)
+    except ValueError as Error:
+        raise SystemExit("ERROR! " + RulesPath + " is not a valid JSON file: " + str(Error))
+    if not isinstance(Rules, dict):
+        raise SystemExit("ERROR! " + RulesPath + " does not hold a JSON object")
+    return Rules
+
+def CheckRule(Name, Rule, Keys):
+    if not isinstance(Rule, dict) or not set(Rule) <= set(Keys):
+        raise SystemExit("ERROR! The rule for " + Name + " can only have the keys "
+                         + ", ".join(Keys))
+
+def BlockNumber(Name, Block):
+    if Block not in BlockNumbers:
+        raise SystemExit("ERROR! The rule for " + Name + " names an unknown block " + str(Block))
+    return BlockNumbers[Block]
+
+def CompileBlocks(Name, Blocks):
+    Mask = np.zeros(10, dtype=bool)
+    Mask[[BlockNumber(Name, Block) for Block in Blocks]] = True
+    return Mask
+
+
+# ParseInput reads the input file and derives every structure that the rest of the program uses
+# from it and from the Rules, and returns them in a dictionary.
+
+def ParseInput(InputPath, Rules):
+
+    # Import the Input File with the 2022-2023 Student and Course Data.  
+    # The "Data" sheet is read once, with fixed types for the numeric columns that we use.
+
+    InputMatrix = pd.read_excel(InputPath, "Data", engine=ExcelEngine,
+                                dtype={"Hoshino Student ID": "int64", "Preference": "int64",
+                                       "number of Sections": "float64", "Capacity": "float64"})
+    InputInfo = InputMatrix.values.tolist()
+
+    # Generate the list of courses and list of students.  Sort both lists.
+    # Let n be the number of students and m be the number of courses.
+    # CourseLookup and StudentLookup map each course name and student ID to its index in these lists.
+
+    CourseList = sorted(set(InputInfo[i][1] for i in range(len(InputInfo)) if not pd.isna(InputInfo[i][1])))
+    StudentList = sorted(set(InputInfo[i][31] for i in range(len(InputInfo))))
+
+    CourseLookup = {CourseName: j for j, CourseName in enumerate(CourseList)}
+    StudentLookup = {StudentID: i for i, StudentID in enumerate(StudentList)}
+
+    n = len(StudentList)
+    m = len(CourseList)
+
+    # For each course j, let CourseSections[j] be the number of sections of that course.
+    # For example, CourseSections[15] = 2 since Course #15 (AP Psychology) has 2 sections.
+
+    CourseSections = [0 for j in range(m)]
+    for j in range(m):
+        CourseName = InputInfo[j][1]
+        NumberOfSections = int(InputInfo[j][5])
+        CourseIndex = CourseLookup[CourseName]
+        CourseSections[CourseIndex] = NumberOfSections
+
+
+    # For each student i, let StudentChoices[i] be the list of courses chosen by that student.
+
+    StudentChoices = [ [] for i in range(n)]
+    for i in range(len(InputInfo)):
+        StudentID = InputInfo[i][31]
+        StudentIndex = StudentLookup[StudentID]
+        CourseName = InputInfo[i][35]
+        CourseIndex = CourseLookup[CourseName]
+        StudentChoices[StudentIndex].append(CourseIndex)
+
+    # For each course j, let CourseRequestList[j] be the list of students who requested that course.
+    # Also, let CourseRequestTotal[j] be the total number of students who requested that course.
+
+    CourseRequestList = [ [] for j in range(m)]
+    CourseRequestTotal = [ 0 for j in range(m)]
+    for i in range(n):
+        for j in StudentChoices[i]:
+            CourseRequestTotal[j] += 1
+            CourseRequestList[j].append(i) 
+
+
+    # For each course j, let PossibleTeachers[j] be the list of possible teachers for that course.
+    # Leave any commas and slash marks as they are.
+
+    PossibleTeachers = [ [] for j in range(m)]
+    for j in range(m):
+        CourseName = InputInfo[j][1]
+        CourseIndex = CourseLookup[CourseName]
+        TeacherInfo = InputInfo[j][6]
+        if pd.notna(TeacherInfo):
+            PossibleTeachers[CourseIndex] = TeacherInfo
+
+
+    # From Column N of the Input Excel file, generate the list of teachers and sort this list.
+
+    TeacherList = []
+    for i in range(len(InputInfo)):
+        TeacherName = InputInfo[i][13]
+        if pd.notna(TeacherName):
+            TeacherList.append(TeacherName)
+    TeacherList.sort()
+
+    TeacherLookup = {}
+    for t, TeacherName in enumerate(TeacherList):
+        TeacherLookup.setdefault(TeacherName, t)
+
+
+    # For each teacher t, let TeacherCourses[t] be the list of courses that MUST be taught
+    # by that teacher.  Each course is a number in range(m), based on the index of the course name
+    # in the variable CourseList.  For all courses with multiple options separated by slash marks / 
+    # (e.g. McAllister/JohnsonCalvert), leave those blank.  Only include courses where there is 
+    # one assigned teacher (e.g. Harms) or multiple teachers separated by commas (Bendl, Boland)
+
+    TeacherCourses = [ [] for t in range(len(TeacherList))]
+    for j in range(m):
+        CourseName = InputInfo[j][1]
+        CourseIndex = CourseLookup[CourseName]
+        TeacherInfo = InputInfo[j][6]
+        if pd.notna(TeacherInfo):
+            TeacherSplit = TeacherInfo.split('/')
+            if len(TeacherSplit) == 1:
+                if TeacherSplit not in [["ANY"], ["PESTAFF"], ["Do not schedule"]]:
+                    TeacherName = TeacherSplit[0]
+                    if ',' in TeacherName:
+                        AllTeachers = TeacherName.split(', ')
+                        for Teacher in AllTeachers:
+                            t = TeacherLookup[Teacher]
+                            TeacherCourses[t].append(CourseIndex)
+                    else:
+                        t = TeacherLookup[TeacherName]
                         TeacherCourses[t].append(CourseIndex)
-                else:
-                    t = TeacherList.index(TeacherName)
-                    TeacherCourses[t].append(CourseIndex)
-                    
-                    
-# For each grade g in [8,9,10,11,12], define StudentsPerGrade[g] to be the list of students 
-# in that grade based on the index of the student name in the variable StudentList.
- 
-StudentsPerGrade = [ [] for i in range(13)]
-for i in range(len(InputInfo)):
-    StudentID = InputInfo[i][31]
-    StudentIndex = StudentList.index(StudentID)
-    StudentGrade = InputInfo[i][34]
-    if StudentGrade == 'Grade 8': StudentsPerGrade[8].append(StudentIndex)
-    if StudentGrade == 'Grade 9': StudentsPerGrade[9].append(StudentIndex)
-    if StudentGrade == 'Grade 10': StudentsPerGrade[10].append(StudentIndex)
-    if StudentGrade == 'Grade 11': StudentsPerGrade[11].append(StudentIndex)
-    if StudentGrade == 'Grade 12': StudentsPerGrade[12].append(StudentIndex)
-StudentsPerGrade[8] = list(set(StudentsPerGrade[8]))
-StudentsPerGrade[9] = list(set(StudentsPerGrade[9]))
-StudentsPerGrade[10] = list(set(StudentsPerGrade[10]))
-StudentsPerGrade[11] = list(set(StudentsPerGrade[11]))
-StudentsPerGrade[12] = list(set(StudentsPerGrade[12]))
-
-
-# For each course j, let RoomLimit[j] be the maximum capacity of that course
-# If a course j has Room Requirement == "General", assume that RoomLimit[j] = 22.
-# Otherwise, take the MAXIMUM value of the options.  
-
-RoomLimit = [0 for j in range(m)]
-RoomChoices = ['' for j in range(m)]
-
-ClassroomList = [['General', 22]]
-
-for k in range(len(InputInfo)):
-    Room = InputInfo[k][18]
-    Cap = InputInfo[k][20]
-    if not pd.isnull(Room):
-        ClassroomList.append([str(Room), int(Cap)])
-        
-for j in range(m):
-    CourseName = InputInfo[j][1]
-    if not pd.isnull(CourseName):
-        CourseIndex = CourseList.index(CourseName)
-        RoomOptions = str(InputInfo[j][9])
-        RoomChoices[CourseIndex] = RoomOptions.split('/')
-        flag=0
-        for k in range(len(ClassroomList)):
-            if ClassroomList[k][0]==RoomOptions:
-                RoomLimit[CourseIndex] = ClassroomList[k][1]
-                flag=1
-        if flag==0:
-            if ',' in RoomOptions:
-                RoomLimit[CourseIndex] = 24
-            else:
-                PossibleRooms = RoomOptions.split('/')            
-                for RoomNum in PossibleRooms:
-                    for k in range(len(ClassroomList)):
-                        if ClassroomList[k][0]==RoomNum:
-                            if ClassroomList[k][1]>RoomLimit[CourseIndex]:
-                                RoomLimit[CourseIndex] = ClassroomList[k][1]
-
-
-# Three exceptions: set RoomLimit[j] = 100 for the following three courses:
-# "Varsity Sport PE 10-12", "Study Block", and "Study Block2".
-
-for CourseName in ['Varsity Sport PE 10-12', 'Study Block', 'Study Block2']:
-    CourseIndex = CourseList.index(CourseName)
-    RoomLimit[CourseIndex] = 100
-
-    
-
-# Determine the set of courses belonging to each of the five departments below
-
-Departments = ["English", "Mathematics", "Languages", "Science", "Social Studies"]
-DepartmentCourses = [[] for d in range(5)]
-
-for j in range(m):
-    CourseName = InputInfo[j][1]
-    CourseIndex = CourseList.index(CourseName)
-    DepartmentName = InputInfo[j][0] 
-    for d in range(5):
-        if DepartmentName == Departments[d]:
-            DepartmentCourses[d].append(CourseIndex)
-            
-            
-# Think of Geology as a Mathematics course rather than a Science course as Geology
-# takes place in a math classroom.
-
-DepartmentCourses[1].append(CourseList.index("Geology 12"))
-DepartmentCourses[3].remove(CourseList.index("Geology 12"))
-
-# Manual changes that need to be made to the data, based on the information
-# provided in Ralph's Excel sheet.
-
-j = CourseList.index("Materials Design 8.")
-RoomLimit[j] = 15
-
-j = CourseList.index("Visual Arts 9.")
-RoomLimit[j] = 23
-
-j = CourseList.index("Science 10x")
-RoomLimit[j] = 25
-
-j = CourseList.index("Theatre Company 10, 11, 12")
-t = TeacherList.index("Penner-Tovey")
-RoomLimit[j] = 50
-TeacherCourses[t].append(j)
-
-j = CourseList.index("Varsity Sport PE 10-12")
-CourseSections[j] = 1
-t = TeacherList.index("McCauley")
-TeacherCourses[t].append(j)
-t = TeacherList.index("GaringerD")
-TeacherCourses[t].append(j)
-
-j = CourseList.index("Global Studies 11/12 Seminar")
-t = TeacherList.index("Liu")
-TeacherCourses[t].append(j)
-t = TeacherList.index("Johnston")
-TeacherCourses[t].append(j)
-
-j = CourseList.index("Environmental Science 12")
-t = TeacherList.index("Harding")
-TeacherCourses[t].append(j)
-
-t = TeacherList.index("Liu")
-for j in TeacherCourses[t]:
-    for k in [5,6]: ForbiddenAssignments.append([j,k])
-        
-t = TeacherList.index("Logher")
-for j in TeacherCourses[t]:
-    for k in [1,2,5,6,7,8,9]: ForbiddenAssignments.append([j,k])
-        
-t = TeacherList.index("Penner-Tovey")
-for j in TeacherCourses[t]:
-    for k in [5,6,7,8,9]: ForbiddenAssignments.append([j,k])
-        
-t = TeacherList.index("McCauley")
-for j in TeacherCourses[t]:
-    for k in [6]: ForbiddenAssignments.append([j,k])
 
-t = TeacherList.index("Elmer")
-for j in TeacherCourses[t]:
-    for k in [3,4,7,8,9]: ForbiddenAssignments.append([j,k])
-        
-t = TeacherList.index("Point")
-for j in TeacherCourses[t]:
-    for k in [3,4,7,8,9]: ForbiddenAssignments.append([j,k])
-        
-t = TeacherList.index("Goddard")
-for j in TeacherCourses[t]:
-    for k in [2,3,4,6,7,8,9]: ForbiddenAssignments.append([j,k])
-        
-# NOTE: we might fix this constraint later, if we can get a better result by switching
-# Pope's required teaching blocks
-t = TeacherList.index("Pope")
-for j in TeacherCourses[t]:
-    for k in [5,6,7,8,9]: ForbiddenAssignments.append([j,k])
-        
-        
-j = CourseList.index("Physical and Health Education 8.")
-CourseSections[j] = 1
-RoomLimit[j] = 80
-RequiredAssignments.append([1,j,2])
-    
-j = CourseList.index("Physical and Health Education 9.")
-CourseSections[j] = 1
-RoomLimit[j] = 80
-RequiredAssignments.append([1,j,1])
-
-j = CourseList.index("Physical and Health Education 10")
-CourseSections[j] = 1
-RoomLimit[j] = 80
-RequiredAssignments.append([1,j,6])
-
-j = CourseList.index("Active Living 11/12")
-for k in [1,2,5,6]:
-    ForbiddenAssignments.append([j,k])
-
-j = CourseList.index("Active Living 11/12 - Individual Pursuits")
-for k in [1,2,3,4,5,6]:  
-    ForbiddenAssignments.append([j,k])
-
-StudentMatrix = pd.read_excel(InputFile, usecols='AF:AL')
-StudentInfo = StudentMatrix.values.tolist()
-
-CourseMatrix = pd.read_excel(InputFile, usecols='A:U')
-CourseMatrix = CourseMatrix[CourseMatrix['Department'].notnull()]
-CourseInfo = CourseMatrix.values.tolist()
-
-
-# GenderInfo[15] = 1 means student15 is male, and GenderInfo[20] = 0 means student20 is female
-# IEP[i, j] will be a binary indicator about whether student i for course j is IEP,
-# so if IEP[0][5] = 1, it means student0 has IEP for course5.
-GenderInfo = [0 for _ in range(n)]
-IEP = [[0 for _ in range(m)] for _ in range(n)]
-
-for i in range(len(StudentMatrix)):
-    row = StudentMatrix.iloc[i]
-    StudentID = row["Hoshino Student ID"]
-    StudentIndex = StudentList.index(StudentID)
-
-    individualGender = row["Gender"].strip()
-    if individualGender == "Male":
-        GenderInfo[StudentIndex] = 1
-    elif individualGender == "Female":
-        GenderInfo[StudentIndex] = 0
-    else:
-        print("ERROR! Unknown gender")
-
-    individualIEP = row["IEP Flag"]
-    CourseName = row["Title Translation"]
-    CourseIndex = CourseList.index(CourseName)
-    if pd.notna(individualIEP):
-        IEP[StudentIndex][CourseIndex] = 1
-
-# Create our preference matrix P[i,j], where i is in range(n) and j is in range(m).
-# P[i,j] is the preference for student i taking course j.
-
-P = np.zeros((n,m), dtype=int)
 
+    # For each grade g in [8,9,10,11,12], define StudentsPerGrade[g] to be the list of students 
+    # in that grade based on the index of the student name in the variable StudentList.
+
+    StudentsPerGrade = [ [] for i in range(13)]
+    for i in range(len(InputInfo)):
+        StudentID = InputInfo[i][31]
+        StudentIndex = StudentLookup[StudentID]
+        StudentGrade = InputInfo[i][34]
+        if StudentGrade == 'Grade 8': StudentsPerGrade[8].append(StudentIndex)
+        if StudentGrade == 'Grade 9': StudentsPerGrade[9].append(StudentIndex)
+        if StudentGrade == 'Grade 10': StudentsPerGrade[10].append(StudentIndex)
+        if StudentGrade == 'Grade 11': StudentsPerGrade[11].append(StudentIndex)
+        if StudentGrade == 'Grade 12': StudentsPerGrade[12].append(StudentIndex)
+    StudentsPerGrade[8] = list(set(StudentsPerGrade[8]))
+    StudentsPerGrade[9] = list(set(StudentsPerGrade[9]))
+    StudentsPerGrade[10] = list(set(StudentsPerGrade[10]))
+    StudentsPerGrade[11] = list(set(StudentsPerGrade[11]))
+    StudentsPerGrade[12] = list(set(StudentsPerGrade[12]))
+
+
+    # For each course j, let RoomLimit[j] be the maximum capacity of that course
+    # If a course j has Room Requirement == "General", assume that RoomLimit[j] = 22.
+    # Otherwise, take the MAXIMUM value of the options.  
+
+    RoomLimit = [0 for j in range(m)]
+    RoomChoices = ['' for j in range(m)]
+
+    ClassroomList = [['General', 22]]
+
+    for k in range(len(InputInfo)):
+        Room = InputInfo[k][18]
+        Cap = InputInfo[k][20]
+        if not pd.isnull(Room):
+            ClassroomList.append([str(Room), int(Cap)])
+
+    for j in range(m):
+        CourseName = InputInfo[j][1]
+        if not pd.isnull(CourseName):
+            CourseIndex = CourseLookup[CourseName]
+            RoomOptions = str(InputInfo[j][9])
+            RoomChoices[CourseIndex] = RoomOptions.split('/')
+            flag=0
+            for k in range(len(ClassroomList)):
+                if ClassroomList[k][0]==RoomOptions:
+                    RoomLimit[CourseIndex] = ClassroomList[k][1]
+                    flag=1
+            if flag==0:
+                if ',' in RoomOptions:
+                    RoomLimit[CourseIndex] = 24
+                else:
+                    PossibleRooms = RoomOptions.split('/')            
+                    for RoomNum in PossibleRooms:
+                        for k in range(len(ClassroomList)):
+                            if ClassroomList[k][0]==RoomNum:
+                                if ClassroomList[k][1]>RoomLimit[CourseIndex]:
+                                    RoomLimit[CourseIndex] = ClassroomList[k][1]
+
+
+    # Determine the set of courses belonging to each of the five departments below
+
+    Departments = ["English", "Mathematics", "Languages", "Science", "Social Studies"]
+    DepartmentCourses = [[] for d in range(5)]
+
+    for j in range(m):
+        CourseName = InputInfo[j][1]
+        CourseIndex = CourseLookup[CourseName]
+        DepartmentName = InputInfo[j][0] 
+        for d in range(5):
+            if DepartmentName == Departments[d]:
+                DepartmentCourses[d].append(CourseIndex)
+
+
+    # Apply the rules file (see LoadRules above).  BlockMask[j,k] is True if a section of
+    # course j can be offered in block k (column 0 is unused, as with the block numbers everywhere
+    # else).  Each "blocks" rule of a course, of its Block Requirement code in Column I, or of a
+    # teacher who must teach it rules out every other block.  If [s,j,k] appears in the
+    # RequiredAssignments list, then section s of course j must be offered in block k.
+
+    BlockMask = np.ones((m, 10), dtype=bool)
+    BlockMask[:, 0] = False
+    RequiredAssignments = []
+
+    def ApplyCourseRule(j, Name, Rule):
+        CheckRule(Name, Rule, CourseRuleKeys)
+        if "blocks" in Rule:
+            BlockMask[j] &= CompileBlocks(Name, Rule["blocks"])
+        for s, Block in Rule.get("required", {}).items():
+            RequiredAssignments.append([int(s), j, BlockNumber(Name, Block)])
+        if "sections" in Rule:
+            CourseSections[j] = int(Rule["sections"])
+        if "capacity" in Rule:
+            RoomLimit[j] = int(Rule["capacity"])
+        for TeacherName in Rule.get("teachers", []):
+            if TeacherName not in TeacherLookup:
+                raise SystemExit("ERROR! The rule for " + Name + " names an unknown teacher "
+                                 + TeacherName)
+            TeacherCourses[TeacherLookup[TeacherName]].append(j)
+        if "department" in Rule:
+            for d in range(5):
+                if j in DepartmentCourses[d]:
+                    DepartmentCourses[d].remove(j)
+            if Rule["department"] in Departments:
+                DepartmentCourses[Departments.index(Rule["department"])].append(j)
+
+    RequirementRules = Rules.get("requirement_codes", {})
+    for x in range(m):
+        Requirement = InputInfo[x][8]
+        if not pd.isnull(Requirement) and Requirement in RequirementRules:
+            j = CourseLookup[InputInfo[x][1]]
+            ApplyCourseRule(j, Requirement, RequirementRules[Requirement])
+
+    for CourseName, Rule in Rules.get("courses", {}).items():
+        if CourseName not in CourseLookup:
+            raise SystemExit("ERROR! The rules file names an unknown course " + CourseName)
+        ApplyCourseRule(CourseLookup[CourseName], CourseName, Rule)
+
+    for TeacherName, Rule in Rules.get("teachers", {}).items():
+        if TeacherName not in TeacherLookup:
+            raise SystemExit("ERROR! The rules file names an unknown teacher " + TeacherName)
+        CheckRule(TeacherName, Rule, TeacherRuleKeys)
+        if "blocks" in Rule:
+            for j in TeacherCourses[TeacherLookup[TeacherName]]:
+                BlockMask[j] &= CompileBlocks(TeacherName, Rule["blocks"])
+
+    # Index the room data by room set.  For each distinct set of rooms R that appears as the room
+    # options of some course (e.g. "200/204/208/210"), RoomCourses[R] is the list of courses whose
+    # room options all lie in R.  In any block, at most len(R) of these courses can be offered, since
+    # each needs its own room from R.  This is a relaxation of the room assignment problem (Hall's
+    # condition on the room sets we know about); for a single room it says at most one course can use
+    # that room.  Courses with a "General" or missing room requirement, or with no sections
+    # after the rules above, are not included.
+
+    RoomCourses = {}
+    RoomCourseList = [j for j in range(m) if CourseSections[j] > 0
+                      and 'General' not in RoomChoices[j] and 'nan' not in RoomChoices[j]]
+    for Rooms in sorted(set(tuple(sorted(set(RoomChoices[j]))) for j in RoomCourseList)):
+        Courses = [j for j in RoomCourseList if set(RoomChoices[j]) <= set(Rooms)]
+        if len(Courses) > len(Rooms):
+            RoomCourses[Rooms] = Courses
+
+    # The student columns AF:AL of the same sheet
+    StudentMatrix = InputMatrix.iloc[:, 31:38]
+
+
+    # GenderInfo[15] = 1 means student15 is male, and GenderInfo[20] = 0 means student20 is female
+    # IEP[i, j] will be a boolean indicator about whether student i for course j is IEP,
+    # so if IEP[0][5] = True, it means student0 has IEP for course5.
+
+    StudentRows = StudentMatrix["Hoshino Student ID"].map(StudentLookup).to_numpy()
+    CourseRows = StudentMatrix["Title Translation"].map(CourseLookup).to_numpy()
+    Genders = StudentMatrix["Gender"].str.strip()
+
+    GenderInfo = np.zeros(n, dtype=int)
+    GenderInfo[StudentRows[(Genders == "Male").to_numpy()]] = 1
+    UnknownGenders = Genders[~Genders.isin(["Male", "Female"])]
+    if len(UnknownGenders) > 0:
+        print("ERROR! Unknown gender in", len(UnknownGenders), "rows:",
+              sorted(set(str(Gender) for Gender in UnknownGenders)))
+
+    IEP = np.zeros((n,m), dtype=bool)
+    HasIEP = StudentMatrix["IEP Flag"].notna().to_numpy()
+    IEP[StudentRows[HasIEP], CourseRows[HasIEP]] = True
+
+    # StudentGrade[i] is the grade of student i (0 if unknown), and Requested[i,j] is True if
+    # student i requested course j.  RequestStudent and RequestCourse list the same requests as
+    # (student, course) pairs, one pair per row of the input file.
+
+    StudentGrade = np.zeros(n, dtype=int)
+    for g in [8,9,10,11,12]:
+        StudentGrade[StudentsPerGrade[g]] = g
+
+    RequestStudent = np.array([i for i in range(n) for j in StudentChoices[i]], dtype=int)
+    RequestCourse = np.array([j for i in range(n) for j in StudentChoices[i]], dtype=int)
+    Requested = np.zeros((n,m), dtype=bool)
+    Requested[RequestStudent, RequestCourse] = True
+
+    # Create our preference matrix P[i,j], where i is in range(n) and j is in range(m).
+    # P[i,j] is the preference for student i taking course j.
+
+    # Assume the following weights for the "elective" courses: +2 for Gr.8, +5 for Gr.9, 
+    # +12 for Gr.10, +25 for Gr.11, +40 for Gr. 12.
+
+    GradeWeight = np.zeros(13, dtype=int)
+    GradeWeight[[8,9,10,11,12]] = [20,30,40,50,60]
+    P = np.where(Requested, GradeWeight[StudentGrade][:, None], 0)
+
+
+    # Manually fix the preference coefficients for the unlucky students who did not get into all of their courses
+
+    UnluckyStudents = [169, 135, 202, 139, 183, 248, 250, 246, 377, 83, 344, 249, 123, 272, 19, 227, 361, 362, 34, 86, 401, 35, 297, 163, 339, 21, 398]
+    if not SchoolData:
+        UnluckyStudents = []
+    for i in UnluckyStudents:
+        for k in range(len(StudentChoices[i])):
+            j = StudentChoices[i][k]
+            P[i,j] = 10 - k
+
+
+    # Overwrite the above preference coefficients for the following cases:
+    # Study blocks count as +1
+    # All cancelled courses (e.g. Beginner Spanish) and out-of-the-timetable courses 
+    # (e.g. Choral Music) are given weight 0 since these 0-section courses are not in the timetable.
+
+    StudyColumns = np.isin(CourseList, ['Study Block', 'Study Block2'])
+    P[:, StudyColumns] = np.where(P[:, StudyColumns] > 0, 1, P[:, StudyColumns])
+    CancelledColumns = np.array(CourseSections) == 0
+    P[:, CancelledColumns] = np.where(P[:, CancelledColumns] > 0, 0, P[:, CancelledColumns])
+
+    # Decide which courses will need to have IEPs considered.  Ralph's rule is
+    # only courses where 15% of students (or more) have IEPs.  IEPTotal[j] is the number of
+    # students with an IEP for course j.
+
+    IEPTotal = IEP.sum(axis=0)
+    RequestTotals = np.array(CourseRequestTotal)
+    IEPShare = np.divide(IEPTotal, RequestTotals, out=np.zeros(m), where=RequestTotals > 0)
+    IEPcourses = [int(j) for j in np.flatnonzero((RequestTotals > 0) & (IEPShare >= 0.15))]
+
+    # For each course j, let CourseRequesters[j] be the sorted list of the distinct students who
+    # requested course j, and CourseIEPStudents[j] the ones among them with an IEP for course j.
+    # Only these students can ever be assigned to course j, so the capacity, IEP and balancing
+    # constraints only need to sum over them.
+
+    CourseRequesters = [sorted(set(CourseRequestList[j])) for j in range(m)]
+    CourseIEPStudents = [[i for i in CourseRequesters[j] if IEP[i,j]] for j in range(m)]
+
+    return {"CourseList": CourseList,
+            "StudentList": StudentList,
+            "CourseLookup": CourseLookup,
+            "StudentLookup": StudentLookup,
+            "n": n,
+            "m": m,
+            "InputInfo": InputInfo,
+            "CourseSections": CourseSections,
+            "StudentChoices": StudentChoices,
+            "CourseRequestTotal": CourseRequestTotal,
+            "BlockMask": BlockMask,
+            "RequiredAssignments": RequiredAssignments,
+            "PossibleTeachers": PossibleTeachers,
+            "TeacherList": TeacherList,
+            "TeacherCourses": TeacherCourses,
+            "StudentsPerGrade": StudentsPerGrade,
+            "RoomLimit": RoomLimit,
+            "RoomChoices": RoomChoices,
+            "RoomCourses": RoomCourses,
+            "Departments": Departments,
+            "DepartmentCourses": DepartmentCourses,
+            "GenderInfo": GenderInfo,
+            "IEP": IEP,
+            "P": P,
+            "IEPTotal": IEPTotal,
+            "IEPcourses": IEPcourses,
+            "CourseRequesters": CourseRequesters,
+            "CourseIEPStudents": CourseIEPStudents}
+
+
+# Parsing the workbook takes much longer than everything else before the first solve, so the
+# result of ParseInput is cached in InputCache, next to the input file.  The cache is only used
+# if it was written for exactly the same workbook and rules file (by their SHA-256 hashes), for the
+# same SchoolData and for the same InputCacheVersion.  Increase InputCacheVersion whenever
+# ParseInput changes.
+
+InputCacheVersion = 4
+InputCache = Options.input + ".cache.pickle"
+
+def InputCacheKey(InputDigest, RulesPath):
+    return [InputCacheVersion, InputDigest, SchoolData, FileDigest(RulesPath)]
+
+def LoadInputCache(Key):
+    try:
+        file = open(InputCache, 'rb')
+        Snapshot = pickle.load(file)
+        file.close()
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+    if not isinstance(Snapshot, dict) or Snapshot.get("key") != Key:
+        return None
+    return Snapshot["data"]
+
+def SaveInputCache(Key, InputData):
+    try:
+        file = open(InputCache + ".tmp", 'wb')
+        pickle.dump({"key": Key, "data": InputData}, file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.close()
+        os.replace(InputCache + ".tmp", InputCache)
+    except OSError:
+        print("Could not write the input cache", InputCache)
+
+InputKey = InputCacheKey(InputDigest, Options.rules)
+InputData = None if Options.no_input_cache else LoadInputCache(InputKey)
+if InputData is None:
+    InputData = ParseInput(Options.input, LoadRules(Options.rules))
+    if not Options.no_input_cache:
+        SaveInputCache(InputKey, InputData)
+
+CourseList = InputData["CourseList"]
+StudentList = InputData["StudentList"]
+CourseLookup = InputData["CourseLookup"]
+StudentLookup = InputData["StudentLookup"]
+n = InputData["n"]
+m = InputData["m"]
+InputInfo = InputData["InputInfo"]
+CourseSections = InputData["CourseSections"]
+StudentChoices = InputData["StudentChoices"]
+CourseRequestTotal = InputData["CourseRequestTotal"]
+BlockMask = InputData["BlockMask"]
+RequiredAssignments = InputData["RequiredAssignments"]
+PossibleTeachers = InputData["PossibleTeachers"]
+TeacherList = InputData["TeacherList"]
+TeacherCourses = InputData["TeacherCourses"]
+StudentsPerGrade = InputData["StudentsPerGrade"]
+RoomLimit = InputData["RoomLimit"]
+RoomChoices = InputData["RoomChoices"]
+RoomCourses = InputData["RoomCourses"]
+Departments = InputData["Departments"]
+DepartmentCourses = InputData["DepartmentCourses"]
+GenderInfo = InputData["GenderInfo"]
+IEP = InputData["IEP"]
+P = InputData["P"]
+IEPTotal = InputData["IEPTotal"]
+IEPcourses = InputData["IEPcourses"]
+CourseRequesters = InputData["CourseRequesters"]
+CourseIEPStudents = InputData["CourseIEPStudents"]
 
-# Assume the following weights for the "elective" courses: +2 for Gr.8, +5 for Gr.9, 
-# +12 for Gr.10, +25 for Gr.11, +40 for Gr. 12.
+print("There are", n, "students to be timetabled into", m, "courses")
 
-for i in StudentsPerGrade[8]:
-    for j in StudentChoices[i]: P[i,j] = 20
-for i in StudentsPerGrade[9]:
-    for j in StudentChoices[i]: P[i,j] = 30
-for i in StudentsPerGrade[10]:
-    for j in StudentChoices[i]: P[i,j] = 40
-for i in StudentsPerGrade[11]:
-    for j in StudentChoices[i]: P[i,j] = 50
-for i in StudentsPerGrade[12]:
-    for j in StudentChoices[i]: P[i,j] = 60
-        
-    
-# Manually fix the preference coefficients for the unlucky students who did not get into all of their courses
+# For each course j, let CourseBlocks[j] be the list of blocks in which some section of course j
+# could actually be offered.  A block is ruled out if BlockMask[j,k] is False, and if every
+# section of course j is pinned down by RequiredAssignments then only those blocks remain.
 
-UnluckyStudents = [169, 135, 202, 139, 183, 248, 250, 246, 377, 83, 344, 249, 123, 272, 19, 227, 361, 362, 34, 86, 401, 35, 297, 163, 339, 21, 398]
-for i in UnluckyStudents:
-    for k in range(len(StudentChoices[i])):
-        j = StudentChoices[i][k]
-        P[i,j] = 10 - k
-        
-        
-# Overwrite the above preference coefficients for the following cases:
-# Study blocks count as +1
-# All cancelled courses (e.g. Beginner Spanish) and out-of-the-timetable courses 
-# (e.g. Choral Music) are given weight 0 since these 0-section courses are not in the timetable.
+RequiredBlocks = [{} for j in range(m)]
+for z in RequiredAssignments:
+    RequiredBlocks[z[1]][z[0]] = z[2]
 
+CourseBlocks = [[] for j in range(m)]
 for j in range(m):
-    if CourseList[j] in ['Study Block', 'Study Block2']:
-        for i in range(n):
-            if P[i,j]>0: P[i,j] = 1
     if CourseSections[j] == 0:
-        for i in range(n):
-            if P[i,j]>0: P[i,j] = 0
-
-# Decide which courses will need to have IEPs considered.  Ralph's rule is
-# only courses where 15% of students (or more) have IEPs.
-
-IEPcourses = []
-for j in range(m):
-    IEPcount = 0
-    for i in range(n):
-        if IEP[i][j] == 1:
-            IEPcount +=1
-    if CourseRequestTotal[j]>0:
-        if IEPcount/CourseRequestTotal[j]>=0.15:
-            IEPcourses.append(j)
-
-# Create Hill-Climbing Program
+        continue
+    if all(s in RequiredBlocks[j] for s in range(1, CourseSections[j]+1)):
+        Candidates = sorted(set(RequiredBlocks[j][s] for s in range(1, CourseSections[j]+1)))
+    else:
+        Candidates = [1,2,3,4,5,6,7,8,9]
+    CourseBlocks[j] = [k for k in Candidates if BlockMask[j,k]]
+
+
+# If SparseModel is True, HillClimber only creates the variable y[i,j,k] when student i requested
+# course j (P[i,j] > 0) and k is in CourseBlocks[j].  Every other y[i,j,k] would be pinned to zero
+# by CONSTRAINT 11 or CONSTRAINT 12 anyway, so this gives the same optimal timetable with a small
+# fraction of the variables.  In the same way, x[s,j,k] is only created for the sections s of
+# course j that are offered (s <= CourseSections[j]) and the blocks k in CourseBlocks[j], so the
+# blocks ruled out by BlockMask need no CONSTRAINT 4 rows.  Every model that uses x creates
+# its x[s,j,k] in the order of XKeys.  Set SparseModel = False to build the original dense model.
+
+SparseModel = True
+
+if SparseModel:
+    XKeys = [(s,j,k) for s in range(1, 10) for j in range(m) if s <= CourseSections[j]
+             for k in CourseBlocks[j]]
+else:
+    XKeys = [(s,j,k) for s in range(1, 10) for j in range(m) for k in range(1, 10)]
+
+
+# The Timetable class holds a timetable as two small integer arrays instead of the lists XSet
+# and YSet.  SectionBlock[s,j] is the block of section s of course j, and StudentBlock[i,j] is the
+# block in which student i takes course j, with 0 for a section that is not offered or a course
+# that the student does not take.  Lookups and moves take constant time and copies are cheap.
+# Sections() and Assignments() return the [s,j,k] and [i,j,k] triples as three arrays each, and
+# XSet() and YSet() return them as sorted lists for the code that works with the lists.
+
+class Timetable:
+
+    def __init__(self, XSet=(), YSet=()):
+        self.SectionBlock = np.zeros((10, m), dtype=np.int8)
+        self.StudentBlock = np.zeros((n, m), dtype=np.int8)
+        XArray = np.array(XSet, dtype=int).reshape(-1, 3)
+        YArray = np.array(YSet, dtype=int).reshape(-1, 3)
+        self.SectionBlock[XArray[:,0], XArray[:,1]] = XArray[:,2]
+        self.StudentBlock[YArray[:,0], YArray[:,1]] = YArray[:,2]
+
+    def Copy(self):
+        Other = Timetable()
+        Other.SectionBlock = self.SectionBlock.copy()
+        Other.StudentBlock = self.StudentBlock.copy()
+        return Other
+
+    # Move section s of course j to block k.
+    def Move(self, s, j, k):
+        self.SectionBlock[s,j] = k
+
+    def Sections(self):
+        S, J = np.nonzero(self.SectionBlock)
+        return S, J, self.SectionBlock[S, J].astype(int)
+
+    def Assignments(self):
+        I, J = np.nonzero(self.StudentBlock)
+        return I, J, self.StudentBlock[I, J].astype(int)
+
+    def XSet(self):
+        return np.column_stack(self.Sections()).tolist()
+
+    def YSet(self):
+        return np.column_stack(self.Assignments()).tolist()
+
+    # Offered[j,k] is True if some section of course j is offered in block k.
+    def Offered(self):
+        Offered = np.zeros((m, 10), dtype=bool)
+        S, J, K = self.Sections()
+        Offered[J, K] = True
+        return Offered
+
+
+# The solver backend for TimetableModel and SectionStudents.  Every backend is used through
+# pywraplp and is given exactly the same constraints, so the results have the same form.  CBC is
+# the original single-threaded solver; CP-SAT runs a portfolio of Threads search workers.  Only
+# the backends in HintBackends are given the warm-start hint (HiGHS crashes on it through pywraplp,
+# and CBC ignores it).
+
+SolverBackends = {"CBC": "CBC", "SCIP": "SCIP", "HIGHS": "HIGHS", "CP-SAT": "SAT"}
+HintBackends = ["SCIP", "CP-SAT"]
+Backend = Options.backend
+if pywraplp.Solver.CreateSolver(SolverBackends[Backend]) is None:
+    Parser.error("the " + Backend + " solver is not available in this version of OR-Tools")
+
+Threads = Options.threads
+if Threads <= 0:
+    Threads = max(1, multiprocessing.cpu_count() // Options.workers) if Backend == "CP-SAT" else 1
+
+def CreateSolver():
+    solver = pywraplp.Solver.CreateSolver(SolverBackends[Backend])
+    solver.SetNumThreads(Threads)
+    if TimeLimit > 0:
+        solver.SetTimeLimit(int(1000 * TimeLimit))
+    if SolverLog:
+        solver.EnableOutput()
+    elif Backend == "HIGHS":
+        # HiGHS prints its banner and log even without EnableOutput, unless output_flag is off.
+        solver.SetSolverSpecificParametersAsString("output_flag=false")
+    return solver
+
+
+# Every solve is limited to TimeLimit seconds and stops at the RelativeGap, if these are given.
+# RunSolver returns the solver status.  The solver found a timetable if the status is in
+# SolvedStatuses, even if it is not proven optimal because it ran out of time.  An infeasible
+# neighbourhood, or one in which no timetable was found in time, is treated as a rejected move.
+# With SolverLog, the solver prints its log (including every improving timetable) while it runs,
+# and RunSolver prints the final status.
+
+TimeLimit = Options.time_limit
+RelativeGap = Options.relative_gap
+SolverLog = Options.solver_log
+
+SolverParameters = pywraplp.MPSolverParameters()
+if RelativeGap is not None:
+    SolverParameters.SetDoubleParam(pywraplp.MPSolverParameters.RELATIVE_MIP_GAP, RelativeGap)
+
+StatusNames = {pywraplp.Solver.OPTIMAL: "optimal", pywraplp.Solver.FEASIBLE: "feasible",
+               pywraplp.Solver.INFEASIBLE: "infeasible", pywraplp.Solver.UNBOUNDED: "unbounded",
+               pywraplp.Solver.ABNORMAL: "abnormal", pywraplp.Solver.NOT_SOLVED: "not solved"}
+
+def RunSolver(solver):
+    SolveStart = time.time()
+    Status = solver.Solve(SolverParameters)
+    if SolverLog:
+        print("Solver status:", StatusNames.get(Status, Status), "after",
+              round(time.time() - SolveStart, 1), "seconds")
+    return Status
+
+SolvedStatuses = [pywraplp.Solver.OPTIMAL, pywraplp.Solver.FEASIBLE]
+
+# Read the solution values of all of the variables of a solved model with a single call, as an
+# array indexed by variable.index(), instead of calling solution_value() on every variable.
+
+def SolutionValues(solver):
+    Response = linear_solver_pb2.MPSolutionResponse()
+    solver.FillSolutionResponseProto(Response)
+    return np.array(Response.variable_value)
+
+
+# Instrumentation.  With --metrics-log, every model build, every solve and every hill-climbing
+# iteration appends one JSON record to MetricsLog.  A ModelMetrics object follows one solver:
+# each call to Mark ends a phase (such as a numbered CONSTRAINT block, or the solve itself) and
+# records its wall time and the number of rows and columns it added to the model.  The number of
+# nonzeros of each phase is read from the exported model when the record is written.  Every record
+# also holds the fields in MetricsContext, such as the current iteration.
+
+MetricsLog = Options.metrics_log
+MetricsContext = {}
+
+def LogMetrics(Event, **Fields):
+    if not MetricsLog:
+        return
+    Record = {"event": Event, "time": round(time.time(), 3), "pid": os.getpid()}
+    Record.update(MetricsContext)
+    Record.update(Fields)
+    file = open(MetricsLog, 'a')
+    file.write(json.dumps(Record) + '\n')
+    file.close()
+
+class ModelMetrics:
+
+    def __init__(self, solver):
+        self.solver = solver
+        self.Phases = []
+        self.Start = time.time()
+        self.Rows = solver.NumConstraints()
+        self.Cols = solver.NumVariables()
+
+    def Mark(self, Phase):
+        Now = time.time()
+        Rows = self.solver.NumConstraints()
+        Cols = self.solver.NumVariables()
+        self.Phases.append({"phase": Phase, "seconds": round(Now - self.Start, 4),
+                            "rows": Rows - self.Rows, "cols": Cols - self.Cols, "first_row": self.Rows})
+        self.Start = Now
+        self.Rows = Rows
+        self.Cols = Cols
+
+    def Log(self, Event, CountNonzeros=False, **Fields):
+        if not MetricsLog:
+            return
+        if CountNonzeros:
+            Proto = linear_solver_pb2.MPModelProto()
+            self.solver.ExportModelToProto(Proto)
+            for Phase in self.Phases:
+                Phase["nonzeros"] = sum(len(Proto.constraint[r].var_index) for r in
+                                        range(Phase["first_row"], Phase["first_row"] + Phase["rows"]))
+        LogMetrics(Event, rows=self.solver.NumConstraints(), cols=self.solver.NumVariables(),
+                   seconds=round(sum(Phase["seconds"] for Phase in self.Phases), 4),
+                   phases=self.Phases, **Fields)
+        self.Phases = []
+
+
+# If SymmetryBreaking is True, TimetableModel adds CONSTRAINT 19 below: the sections of a course
+# are interchangeable, so we require them to be offered in increasing block order.  Sections named
+# in RequiredAssignments keep their blocks and are left out of the ordering.  CONSTRAINT 16 then
+# locks "course j is offered in block k" instead of a particular section, and CanonicalXSet
+# relabels the sections of any timetable so that they follow this order.
+
+SymmetryBreaking = Options.symmetry_breaking
+
+def CanonicalXSet(XSet):
+    Canonical = []
+    FreeBlocks = defaultdict(list)
+    for [s,j,k] in XSet:
+        if s in RequiredBlocks[j]:
+            Canonical.append([s,j,k])
+        else:
+            FreeBlocks[j].append(k)
+    for j in FreeBlocks:
+        OrderedSections = [s for s in range(1, CourseSections[j]+1) if s not in RequiredBlocks[j]]
+        for s, k in zip(OrderedSections, sorted(FreeBlocks[j])):
+            Canonical.append([s,j,k])
+    return sorted(Canonical)
+
+
+# The course side of the model.  AddCourseConstraints adds CONSTRAINTS 1-8 (and CONSTRAINT 19
+# if SymmetryBreaking is True) for the variables x[s,j,k], and returns the CONSTRAINT 2 row of
+# each (course, block).  It is shared by TimetableModel and by CourseTimetable below.
+
+def AddCourseConstraints(solver, x, Metrics):
 
-def HillClimber(XSet, FixedNumber): 
-    
-    solver = pywraplp.Solver('Final Project', pywraplp.Solver.CBC_MIXED_INTEGER_PROGRAMMING)
-    
-    Students = range(len(StudentList))
     Courses = range(len(CourseList))
     Teachers = range(len(TeacherList))
-    
     Sections = [1,2,3,4,5,6,7,8,9]
     Blocks = [1,2,3,4,5,6,7,8,9]
-    
-    # Define boolean variables
-    x = {}
-    for s in Sections:
-        for j in Courses:
-            for k in Blocks:
-                x[s,j,k] = solver.IntVar(0,1, 'x[%d,%d,%d]' % (s,j,k))
-
-    y = {}
-    for i in Students:
-        for j in Courses:
-            for k in Blocks:
-                y[i,j,k] = solver.IntVar(0,1, 'y[%d,%d,%d]' % (i,j,k)) 
 
+    # Group the x variables by (section, course) and (course, block) so that each constraint
+    # below only sums over the variables that exist in the model (see XKeys), and let X(s,j,k) be
+    # x[s,j,k], or 0 if it does not exist.  Add leaves out a constraint without any variables
+    # that holds anyway (such as 0 <= 1), but still adds one that cannot hold (such as 0 == 1),
+    # so that the model is infeasible.  A packing row "at most L of these x[s,j,k]" is also left
+    # out when it has no more than L variables.
+    XSectionCourse = defaultdict(list)
+    XCourseBlock = defaultdict(list)
+    for (s,j,k) in x:
+        XSectionCourse[s,j].append(x[s,j,k])
+        XCourseBlock[j,k].append(x[s,j,k])
+
+    def X(s, j, k):
+        return x.get((s,j,k), 0)
+
+    def Add(Constraint):
+        if Constraint is not True:
+            return solver.Add(Constraint)
 
     # CONSTRAINT 1: For each course, ensure the correct number of sections are offered.
     for j in Courses:
         for s in Sections:
             if s <= CourseSections[j]:
-                solver.Add(sum(x[s,j,k] for k in Blocks) == 1)
+                Add(sum(XSectionCourse[s,j]) == 1)
             else:
-                solver.Add(sum(x[s,j,k] for k in Blocks) == 0)
+                Add(sum(XSectionCourse[s,j]) == 0)
+    Metrics.Mark("CONSTRAINT 1")
+
 
-                
     # CONSTRAINT 2: Two sections of the same course can't be offered in the same block
+    OfferedRows = {}
     for j in Courses:
         for k in Blocks:
-            solver.Add(sum(x[s,j,k] for s in Sections) <= 1)
+            if XCourseBlock[j,k]:
+                OfferedRows[j,k] = solver.Add(sum(XCourseBlock[j,k]) <= 1)
+    Metrics.Mark("CONSTRAINT 2")
 
 
     # CONSTRAINT 3: For each teacher, all of their required courses must occur in separate blocks
     for t in Teachers:
         for k in Blocks:
-            solver.Add( sum(x[s,j,k] for s in Sections for j in TeacherCourses[t]) <= 1)              
+            TeacherVars = [Var for j in TeacherCourses[t] for Var in XCourseBlock[j,k]]
+            if len(TeacherVars) > 1:
+                solver.Add(sum(TeacherVars) <= 1)
+    Metrics.Mark("CONSTRAINT 3")
 
 
-    # CONSTRAINT 4: Ensure forbidden assignments are not made
-    for z in ForbiddenAssignments:
-        j = z[0]
-        k = z[1]
-        for s in Sections:
-            solver.Add(x[s,j,k]==0)
+    # CONSTRAINT 4: Ensure forbidden assignments are not made.  In the sparse model, the
+    # x[s,j,k] of the blocks ruled out by BlockMask are never created instead.
+    if not SparseModel:
+        for j in Courses:
+            for k in Blocks:
+                if not BlockMask[j,k]:
+                    for s in Sections:
+                        solver.Add(x[s,j,k]==0)
+        Metrics.Mark("CONSTRAINT 4")
 
 
     # CONSTRAINT 5: ensure required assignments are made
@@ -505,16 +921,18 @@ def HillClimber(XSet, FixedNumber):
         s = z[0]
         j = z[1]
         k = z[2]
-        solver.Add(x[s,j,k]==1)
+        Add(X(s,j,k)==1)
+    Metrics.Mark("CONSTRAINT 5")
 
 
-    # CONSTRAINT 6: No room can be used twice in the same block.
-    for p in Courses:
-        for q in Courses:
-            if p<q and RoomChoices[p]==RoomChoices[q]:
-                if len(RoomChoices[p])==1 and RoomChoices[p] != ['General'] and RoomChoices[p] != ['nan']:
-                    for k in Blocks:
-                        solver.Add( sum(x[s,p,k]+x[s,q,k] for s in Sections) <= 1)
+    # CONSTRAINT 6: No room can be used twice in the same block.  For each room set in
+    # RoomCourses, the courses that must use a room from that set fit in its rooms.
+    for Rooms in RoomCourses:
+        for k in Blocks:
+            RoomVars = [Var for j in RoomCourses[Rooms] for Var in XCourseBlock[j,k]]
+            if len(RoomVars) > len(Rooms):
+                solver.Add(solver.Sum(RoomVars) <= len(Rooms))
+    Metrics.Mark("CONSTRAINT 6")
 
 
     # CONSTRAINT 7: Due to room constraints, every block can have at most 4 courses from each of
@@ -523,218 +941,982 @@ def HillClimber(XSet, FixedNumber):
 
     for d in range(5):
         for k in Blocks:
-            solver.Add(sum(sum(x[s,j,k] for j in DepartmentCourses[d]) for s in Sections) <= 5)
+            DepartmentVars = [Var for j in DepartmentCourses[d] for Var in XCourseBlock[j,k]]
+            if len(DepartmentVars) > 5:
+                solver.Add(sum(DepartmentVars) <= 5)
+    Metrics.Mark("CONSTRAINT 7")
 
 
     # CONSTRAINT 8: Ensure CALC12, APCALA, APCAL12 are all in the same block, with PH12 not
     # being in that block.
-    
-    j1 = CourseList.index("AP Calculus AB")
-    j2 = CourseList.index("AP Calculus BC")
-    j3 = CourseList.index("Calculus 12")
-    j4 = CourseList.index("Physics 12")
+
+    j1 = CourseLookup["AP Calculus AB"]
+    j2 = CourseLookup["AP Calculus BC"]
+    j3 = CourseLookup["Calculus 12"]
+    j4 = CourseLookup["Physics 12"]
     for k in Blocks:
-        solver.Add(x[1,j1,k]==x[1,j2,k])
-        solver.Add(x[1,j2,k]==x[1,j3,k])
-        solver.Add(x[1,j1,k]+x[1,j4,k]+x[2,j4,k] <= 1)
-        solver.Add(x[1,j2,k]+x[1,j4,k]+x[2,j4,k] <= 1)
-        solver.Add(x[1,j3,k]+x[1,j4,k]+x[2,j4,k] <= 1)
-    
-    
-            
-    # CONSTRAINT 9: Each student takes at most one course per block
-    for i in Students:
-        for k in Blocks: 
-            solver.Add(sum(y[i,j,k] for j in Courses) <= 1)
+        Add(X(1,j1,k)==X(1,j2,k))
+        Add(X(1,j2,k)==X(1,j3,k))
+        Add(X(1,j1,k)+X(1,j4,k)+X(2,j4,k) <= 1)
+        Add(X(1,j2,k)+X(1,j4,k)+X(2,j4,k) <= 1)
+        Add(X(1,j3,k)+X(1,j4,k)+X(2,j4,k) <= 1)
+    Metrics.Mark("CONSTRAINT 8")
 
 
-    # CONSTRAINT 10: No student can take the same course twice       
-    for i in Students:
+    # CONSTRAINT 19 (only if SymmetryBreaking is True): the sections of each course that are
+    # not named in RequiredAssignments are offered in increasing block order.
+    if SymmetryBreaking:
         for j in Courses:
-            solver.Add(sum(y[i,j,k] for k in Blocks) <= 1)
-               
+            OrderedSections = [s for s in range(1, CourseSections[j]+1) if s not in RequiredBlocks[j]]
+            for s, t in zip(OrderedSections, OrderedSections[1:]):
+                Add(sum(k*X(s,j,k) for k in Blocks) + 1 <= sum(k*X(t,j,k) for k in Blocks))
+        Metrics.Mark("CONSTRAINT 19")
 
-    # CONSTRAINT 11: No student can take a course in a block when that course isn't offered
-    for i in Students:
-        for j in Courses:
-            for k in Blocks:
-                solver.Add(y[i,j,k] <= sum(x[s,j,k] for s in Sections))
+    return OfferedRows
 
 
-    # CONSTRAINT 12: Do not assign course j to a student i if P[i,j]=0
-    for i in Students:
-        for j in Courses:
-            if P[i,j]==0:    
-                for k in Blocks:
-                    solver.Add(y[i,j,k]==0)
+# The student side of the model.  AddStudentConstraints adds CONSTRAINTS 9, 10, 13, 14, 15, 17
+# and 18 for the variables y[i,j,k] with (i,j,k) in YKeys.  It is shared by TimetableModel and by
+# SectionStudents below.
 
+def AddStudentConstraints(solver, y, YKeys, Metrics):
 
-    # CONSTRAINT 13: No course section can exceed its room capacity
-    for j in Courses:
+    Students = range(len(StudentList))
+    Blocks = [1,2,3,4,5,6,7,8,9]
+
+    # Group the y variables by (student, block) and (student, course) so that each constraint
+    # below only sums over the variables that exist in the model.  For each (course, block),
+    # YCourseBlock only holds the variables of the students who requested the course; in the
+    # dense model, every other y[i,j,k] is fixed to zero by CONSTRAINT 12.
+    YStudentBlock = defaultdict(list)
+    YStudentCourse = defaultdict(list)
+    for (i,j,k) in YKeys:
+        YStudentBlock[i,k].append(y[i,j,k])
+        YStudentCourse[i,j].append(y[i,j,k])
+
+    YCourseBlock = {}
+    for j in range(len(CourseList)):
         for k in Blocks:
-            solver.Add(sum(y[i,j,k] for i in Students) <= RoomLimit[j])   
+            YCourseBlock[j,k] = [y[i,j,k] for i in CourseRequesters[j] if (i,j,k) in y]
+    Metrics.Mark("student groups")
+
+
+    # CONSTRAINT 9: Each student takes at most one course per block
+    for (i,k) in YStudentBlock:
+        solver.Add(solver.Sum(YStudentBlock[i,k]) <= 1)
+    Metrics.Mark("CONSTRAINT 9")
+
+
+    # CONSTRAINT 10: No student can take the same course twice       
+    for (i,j) in YStudentCourse:
+        solver.Add(solver.Sum(YStudentCourse[i,j]) <= 1)
+    Metrics.Mark("CONSTRAINT 10")
+
+
+    # CONSTRAINT 13: No course section can exceed its room capacity
+    for (j,k) in YCourseBlock:
+        if YCourseBlock[j,k]:
+            solver.Add(solver.Sum(YCourseBlock[j,k]) <= RoomLimit[j])
+    Metrics.Mark("CONSTRAINT 13")
+
 
-            
     # CONSTRAINT 14: No student can take StudyBlock and StudyBlock2 on the same day.
     # except students 155 and 234
-    j1 = CourseList.index("Study Block")
-    j2 = CourseList.index("Study Block2")
+    j1 = CourseLookup["Study Block"]
+    j2 = CourseLookup["Study Block2"]
     for i in Students:
         if not StudentList[i] in [155,234]:
-            solver.Add(sum(y[i,j1,k] + y[i,j2,k] for k in [1,2,3,4]) <= 1)
-            solver.Add(sum(y[i,j1,k] + y[i,j2,k] for k in [5,6,7,8,9]) <= 1)
-         
-            
+            for Day in [[1,2,3,4], [5,6,7,8,9]]:
+                StudyVars = [y[i,j,k] for j in [j1,j2] for k in Day if (i,j,k) in y]
+                if StudyVars:
+                    solver.Add(solver.Sum(StudyVars) <= 1)
+    Metrics.Mark("CONSTRAINT 14")
+
+
     # CONSTRAINT 15: At most 30 students can be in a Study Block in any given block
-    j1 = CourseList.index("Study Block")
-    j2 = CourseList.index("Study Block2")
+    j1 = CourseLookup["Study Block"]
+    j2 = CourseLookup["Study Block2"]
     for k in Blocks:
-        solver.Add(sum(y[i,j1,k] + y[i,j2,k] for i in Students) <= 30)   
-    
-            
-    # CONSTRAINT 16: For all of the x[s,j,k] assignments from XSet, lock in all of them
-    # except for some number of course sections (defined by FixedNumber) that we can move 
-    # to other blocks to optimize the quality of our timetable.  To do this, we first use the
-    # random package to shuffle XSet, and then allow only the first FixedNumber course sections 
-    # of our shuffled XSet to be changed.
-    
-    shuffle(XSet)
-    for z in range(FixedNumber, len(XSet)):
-        s = XSet[z][0]
-        j = XSet[z][1]
-        k = XSet[z][2]
-        solver.Add(x[s,j,k] == 1)
- 
+        StudyVars = YCourseBlock[j1,k] + YCourseBlock[j2,k]
+        if StudyVars:
+            solver.Add(solver.Sum(StudyVars) <= 30)
+    Metrics.Mark("CONSTRAINT 15")
+
 
     # CONSTRAINT 17: Add our IEP constraints
-    
+
     for j in IEPcourses:
         for k in Blocks:
+            IEPVars = [y[i,j,k] for i in CourseIEPStudents[j] if (i,j,k) in y]
+            if not IEPVars:
+                continue
             if CourseSections[j] == 2:
-                solver.Add(sum(y[i,j,k] for i in Students if IEP[i][j] == 1)
-                       <= 0.60 * sum(IEP[_][j] for _ in range(len(IEP)))) 
+                solver.Add(solver.Sum(IEPVars) <= 0.60 * IEPTotal[j])
             if CourseSections[j] == 3:
-                solver.Add(sum(y[i,j,k] for i in Students if IEP[i][j] == 1)
-                       <= 0.40 * sum(IEP[_][j] for _ in range(len(IEP)))) 
+                solver.Add(solver.Sum(IEPVars) <= 0.40 * IEPTotal[j])
             if CourseSections[j] == 4:
-                solver.Add(sum(y[i,j,k] for i in Students if IEP[i][j] == 1)
-                       <= 0.31 * sum(IEP[_][j] for _ in range(len(IEP)))) 
+                solver.Add(solver.Sum(IEPVars) <= 0.31 * IEPTotal[j])
             if CourseSections[j] == 5:
-                solver.Add(sum(y[i,j,k] for i in Students if IEP[i][j] == 1)
-                       <= 0.25 * sum(IEP[_][j] for _ in range(len(IEP)))) 
+                solver.Add(solver.Sum(IEPVars) <= 0.25 * IEPTotal[j])
+    Metrics.Mark("CONSTRAINT 17")
+
 
-        
     # CONSTRAINT 18: Add balancing constraints to ensure each course section has roughly the
     # same number of students.  No 2-section course can have more than 54% of the enrolled 
     # students in one section.  Do the same for 3-section, 4-section, and 5-section courses.
-    
-    
+
+
     # NOTE TO ME - change this back to what I had earlier (0.54, 0.36, 0.3, 0.27, 0.25)
-    
-    for j in Courses:
-        for k in Blocks:
-            if CourseSections[j]==2:
-                solver.Add(sum(y[i,j,k] for i in Students) <= 0.54 * CourseRequestTotal[j])  
-            if CourseSections[j]==3:
-                if "8." in CourseList[j]:
-                    solver.Add(sum(y[i,j,k] for i in Students) <= 0.4 * CourseRequestTotal[j])
-                else:
-                    solver.Add(sum(y[i,j,k] for i in Students) <= 0.36 * CourseRequestTotal[j])
-            if CourseSections[j]==4:
-                solver.Add(sum(y[i,j,k] for i in Students) <= 0.265 * CourseRequestTotal[j])
-            if CourseSections[j]==5:
-                if CourseList[j] == "Guided Study Block":
-                    solver.Add(sum(y[i,j,k] for i in Students) <= 0.4 * CourseRequestTotal[j]) 
-                elif "8." in CourseList[j]:
-                    solver.Add(sum(y[i,j,k] for i in Students) <= 0.24 * CourseRequestTotal[j]) 
-                else:
-                    solver.Add(sum(y[i,j,k] for i in Students) <= 0.22 * CourseRequestTotal[j]) 
-                    
+
+    for (j,k) in YCourseBlock:
+        if not YCourseBlock[j,k] or CourseSections[j] not in [2,3,4,5]:
+            continue
+        Enrolled = solver.Sum(YCourseBlock[j,k])
+        if CourseSections[j]==2:
+            solver.Add(Enrolled <= 0.54 * CourseRequestTotal[j])
+        if CourseSections[j]==3:
+            if "8." in CourseList[j]:
+                solver.Add(Enrolled <= 0.4 * CourseRequestTotal[j])
+            else:
+                solver.Add(Enrolled <= 0.36 * CourseRequestTotal[j])
+        if CourseSections[j]==4:
+            solver.Add(Enrolled <= 0.265 * CourseRequestTotal[j])
+        if CourseSections[j]==5:
+            if CourseList[j] == "Guided Study Block":
+                solver.Add(Enrolled <= 0.4 * CourseRequestTotal[j])
+            elif "8." in CourseList[j]:
+                solver.Add(Enrolled <= 0.24 * CourseRequestTotal[j])
+            else:
+                solver.Add(Enrolled <= 0.22 * CourseRequestTotal[j])
+
     for k in Blocks:
-        j = CourseList.index("Active Living 11/12")
-        solver.Add(sum(y[i,j,k] for i in Students) <= 19)
-        j = CourseList.index("Pre-Calculus 11")
-        solver.Add(sum(y[i,j,k] for i in Students) <= 15)
-       
-    
-    
-    # Solve the Integer Linear Program!
-    solver.Maximize(solver.Sum(P[i,j]*y[i,j,k]
-                   for i in Students for j in Courses for k in Blocks))
-    sol = solver.Solve()
+        j = CourseLookup["Active Living 11/12"]
+        if YCourseBlock[j,k]:
+            solver.Add(solver.Sum(YCourseBlock[j,k]) <= 19)
+        j = CourseLookup["Pre-Calculus 11"]
+        if YCourseBlock[j,k]:
+            solver.Add(solver.Sum(YCourseBlock[j,k]) <= 15)
+    Metrics.Mark("CONSTRAINT 18")
+
+
+# Create Hill-Climbing Program
+
+# The TimetableModel class builds the parts of the Integer Linear Program that never change
+# between hill-climbing iterations (every constraint except CONSTRAINT 16) exactly once.
+# Each call to Solve then only locks the sections of XSet in place by raising the lower bound
+# of x[s,j,k] to 1, and releases the sections that were locked by the previous call.
+
+class TimetableModel:
+
+    def __init__(self):
+
+        solver = CreateSolver()
+        Metrics = ModelMetrics(solver)
+
+        Students = range(len(StudentList))
+        Courses = range(len(CourseList))
+
+        Sections = [1,2,3,4,5,6,7,8,9]
+        Blocks = [1,2,3,4,5,6,7,8,9]
+
+        # Define boolean variables
+        x = {}
+        for (s,j,k) in XKeys:
+            x[s,j,k] = solver.IntVar(0,1, 'x[%d,%d,%d]' % (s,j,k))
+        Metrics.Mark("x variables")
+
+        if SparseModel:
+            YKeys = [(i,j,k) for i in Students for j in sorted(set(StudentChoices[i]))
+                     if P[i,j] > 0 for k in CourseBlocks[j]]
+        else:
+            YKeys = [(i,j,k) for i in Students for j in Courses for k in Blocks]
+
+        y = {}
+        for (i,j,k) in YKeys:
+            y[i,j,k] = solver.IntVar(0,1, 'y[%d,%d,%d]' % (i,j,k))
+        Metrics.Mark("y variables")
+
+
+        # CONSTRAINTS 1-8 (and 19)
+        OfferedRows = AddCourseConstraints(solver, x, Metrics)
+
+
+        # CONSTRAINT 11: No student can take a course in a block when that course isn't offered
+        for (i,j,k) in YKeys:
+            solver.Add(y[i,j,k] <= sum(x[s,j,k] for s in Sections if (s,j,k) in x))
+        Metrics.Mark("CONSTRAINT 11")
+
+
+        # CONSTRAINT 12: Do not assign course j to a student i if P[i,j]=0
+        # (In the sparse model these variables are never created.)
+        if not SparseModel:
+            for i in Students:
+                for j in Courses:
+                    if P[i,j]==0:
+                        for k in Blocks:
+                            solver.Add(y[i,j,k]==0)
+            Metrics.Mark("CONSTRAINT 12")
+
+
+        # CONSTRAINTS 9, 10, 13, 14, 15, 17 and 18
+        AddStudentConstraints(solver, y, YKeys, Metrics)
+
+
+        # Our objective: maximize the total preference of all assigned student requests.
+        solver.Maximize(solver.Sum(P[i,j]*y[i,j,k] for (i,j,k) in YKeys))
+
+        # Objective cutoff: Solve can require the new timetable to score at least Cutoff points,
+        # so that CBC gives up on a neighbourhood as soon as it proves that this is impossible.
+        ObjectiveCut = solver.Constraint(-solver.infinity(), solver.infinity())
+        for (i,j,k) in YKeys:
+            ObjectiveCut.SetCoefficient(y[i,j,k], int(P[i,j]))
+        Metrics.Mark("objective")
+        Metrics.Log("build", CountNonzeros=True, model="TimetableModel")
+
+        self.solver = solver
+        self.x = x
+        self.y = y
+        self.YKeys = YKeys
+        self.XKeyArray = np.array(list(x), dtype=int)
+        self.YKeyArray = np.array(YKeys, dtype=int).reshape(-1, 3)
+        self.XIndices = np.array([x[Key].index() for Key in x], dtype=int)
+        self.YIndices = np.array([y[Key].index() for Key in YKeys], dtype=int)
+        self.OfferedRows = OfferedRows
+        self.ObjectiveCut = ObjectiveCut
+        self.Metrics = Metrics
+        self.Locked = []
+
+    def Solve(self, Current, FixedNumber, Cutoff=None, Incumbent=None, FreeSections=None):
+
+        solver = self.solver
+        x = self.x
+        y = self.y
+        YKeys = self.YKeys
+        Metrics = self.Metrics
+        Metrics.Start = time.time()
+
+        for Locked in self.Locked:
+            Locked.SetLb(0)
+        self.Locked = []
+
+        # CONSTRAINT 16: For all of the x[s,j,k] assignments from XSet (the sections of the
+        # Current timetable), lock in all of them
+        # except for some number of course sections (defined by FixedNumber) that we can move 
+        # to other blocks to optimize the quality of our timetable.  To do this, we first use the
+        # random package to shuffle XSet, and then allow only the first FixedNumber course sections 
+        # of our shuffled XSet to be changed.  Any [s,j] in FreeSections is moved to the front of
+        # XSet first, so that these sections are always among the ones that can be changed.
+        # With SymmetryBreaking, XSet is first relabelled by CanonicalXSet.  For a course with a
+        # section that is free to move, we lock the CONSTRAINT 2 row of (course, block) instead of
+        # x[s,j,k], so that any section of the course may be the one offered in that block.
+        # FreeSections uses the section numbers of Current, which the relabelling can change, so
+        # its sections are matched by (course, block) in FreeBlocks.  If all of them fit into the
+        # FixedNumber free sections, none of their blocks may be locked.
+
+        XSet = Current.XSet()
+        if SymmetryBreaking:
+            XSet = CanonicalXSet(XSet)
+        shuffle(XSet)
+        FreeBlocks = set()
+        if FreeSections:
+            FreeBlocks = set((j, int(Current.SectionBlock[s,j])) for [s,j] in FreeSections)
+            XSet.sort(key=lambda z: (z[1], z[2]) not in FreeBlocks)
+        MovingCourses = set(XSet[z][1] for z in range(min(FixedNumber, len(XSet))))
+        for z in range(FixedNumber, len(XSet)):
+            s = XSet[z][0]
+            j = XSet[z][1]
+            k = XSet[z][2]
+            if (j,k) in FreeBlocks and len(FreeBlocks) <= FixedNumber:
+                raise SystemExit("ERROR! CONSTRAINT 16 locked the screened section of "
+                                 + CourseList[j] + " in block " + str(k))
+            if SymmetryBreaking and j in MovingCourses:
+                self.OfferedRows[j,k].SetLb(1)
+                self.Locked.append(self.OfferedRows[j,k])
+            else:
+                x[s,j,k].SetLb(1)
+                self.Locked.append(x[s,j,k])
+        Metrics.Mark("CONSTRAINT 16")
+
+        # Warm start: the Incumbent [ObjectiveValue, Timetable] is the current timetable, which is
+        # always feasible for this neighbourhood since the locked sections are taken from it.  Pass
+        # it to the solver as a hint on the HintBackends, and also use its objective value as a
+        # lower bound so that the solver can prune every node that cannot reach it.  CBC ignores
+        # hints given through pywraplp, so on CBC the warm start is only this lower bound on the
+        # dense ObjectiveCut row.  It did not measurably shorten the iterations on the 2022-2023
+        # data (81 s against 85 s for --seed 7 --iterations 3 --fixed-number 10, which is noise).
+        LowerBound = -solver.infinity()
+        if Cutoff is not None:
+            LowerBound = Cutoff
+        if Incumbent is not None:
+            Hint = Incumbent[1]
+            if SymmetryBreaking:
+                Hint = Timetable(CanonicalXSet(Hint.XSet()), Hint.YSet())
+            XKeyArray = self.XKeyArray
+            YKeyArray = self.YKeyArray
+            HintX = Hint.SectionBlock[XKeyArray[:,0], XKeyArray[:,1]] == XKeyArray[:,2]
+            HintY = Hint.StudentBlock[YKeyArray[:,0], YKeyArray[:,1]] == YKeyArray[:,2]
+            HintValues = np.concatenate([HintX, HintY]).astype(float).tolist()
+            if Backend in HintBackends:
+                solver.SetHint(list(x.values()) + [y[Key] for Key in YKeys], HintValues)
+            LowerBound = max(LowerBound, Incumbent[0])
+        elif Backend in HintBackends:
+            solver.SetHint([], [])
+        self.ObjectiveCut.SetLb(LowerBound)
+        Metrics.Mark("warm start")
+
+        # Solve the Integer Linear Program!  If there is no timetable in this neighbourhood
+        # (for example, none that reaches the Cutoff) or none was found in time, return None.
+        Status = RunSolver(solver)
+        Metrics.Mark("solve")
+        if Status not in SolvedStatuses:
+            Metrics.Log("solve", model="TimetableModel", status=StatusNames.get(Status, Status),
+                        free_sections=FixedNumber)
+            return None
+        ObjectiveValue = round(solver.Objective().Value())
+
+
+        # Generate the new XSet (the master timetable from the perspective of the courses) and the
+        # new YSet (the master timetable from the perspective of the students), and return them
+        # as a Timetable.
+
+        Values = SolutionValues(solver)
+        XSet = self.XKeyArray[Values[self.XIndices] > 0.5]
+        YSet = self.YKeyArray[Values[self.YIndices] > 0.5]
+        Metrics.Mark("extract")
+        Metrics.Log("solve", model="TimetableModel", status=StatusNames.get(Status, Status),
+                    free_sections=FixedNumber, objective=ObjectiveValue)
+
+        return [ObjectiveValue, Timetable(XSet, YSet)]
+
+
+# Two-stage evaluation.  When every course section of the Current timetable is locked in place
+# (FixedNumber = 0, as in Iteration 0), all of the x[s,j,k] are known and only the assignment of
+# students to the offered sections is left to optimize.  SectionStudents builds just this student
+# side of the model, with y[i,j,k] only for the blocks k in which Current offers course j, so
+# CONSTRAINT 11 is not needed and CONSTRAINTS 1-8 are assumed to hold for Current already.
+
+def SectionStudents(Current, Cutoff=None):
+
+    solver = CreateSolver()
+    Metrics = ModelMetrics(solver)
+
+    Students = range(len(StudentList))
+
+    Offered = Current.Offered()
+    OfferedBlocks = [np.flatnonzero(Offered[j]).tolist() for j in range(len(CourseList))]
+
+    YKeys = [(i,j,k) for i in Students for j in sorted(set(StudentChoices[i]))
+             if P[i,j] > 0 for k in OfferedBlocks[j]]
+
+    y = {}
+    for (i,j,k) in YKeys:
+        y[i,j,k] = solver.IntVar(0,1, 'y[%d,%d,%d]' % (i,j,k))
+    Metrics.Mark("y variables")
+
+    AddStudentConstraints(solver, y, YKeys, Metrics)
+
+    Objective = solver.Sum(P[i,j]*y[i,j,k] for (i,j,k) in YKeys)
+    if Cutoff is not None:
+        solver.Add(Objective >= Cutoff)
+    solver.Maximize(Objective)
+    Metrics.Mark("objective")
+    Metrics.Log("build", CountNonzeros=True, model="SectionStudents")
+
+    Status = RunSolver(solver)
+    Metrics.Mark("solve")
+    if Status not in SolvedStatuses:
+        Metrics.Log("solve", model="SectionStudents", status=StatusNames.get(Status, Status))
+        return None
     ObjectiveValue = round(solver.Objective().Value())
-    
-    
-    # Generate the new XSet (the master timetable from the perspective of the courses) and the
-    # new YSet (the master timetable from the perspective of the students)
-    
-    XSet=[]
-    for s in Sections:
-        for j in Courses:
-            for k in Blocks:
-                if x[s,j,k].solution_value()==1:
-                    XSet.append([s,j,k])            
-    YSet=[]
-    for i in Students:
-        for j in Courses:
-            for k in Blocks:
-                if y[i,j,k].solution_value()==1:
-                    YSet.append([i,j,k])
-                        
-    return [ObjectiveValue, XSet, YSet]
 
-# Pre-load the best timetable found so far
+    # The y[i,j,k] are the only variables of this model, created in the order of YKeys.
+    YSet = np.array(YKeys, dtype=int).reshape(-1, 3)[SolutionValues(solver) > 0.5]
+    Metrics.Mark("extract")
+    Metrics.Log("solve", model="SectionStudents", status=StatusNames.get(Status, Status),
+                objective=ObjectiveValue)
 
-XSet = [[1, 0, 8], [1, 1, 1], [1, 2, 3], [1, 3, 3], [1, 4, 2], [1, 5, 4], [1, 6, 6], [1, 7, 9], [1, 8, 5], [1, 9, 6], [1, 10, 6], [1, 11, 8], [1, 12, 7], [1, 13, 8], [1, 14, 1], [1, 15, 9], [1, 16, 2], [1, 18, 7], [1, 19, 9], [1, 20, 9], [1, 21, 4], [1, 23, 2], [1, 25, 3], [1, 26, 4], [1, 27, 4], [1, 28, 8], [1, 29, 4], [1, 31, 9], [1, 32, 2], [1, 33, 6], [1, 34, 1], [1, 35, 5], [1, 36, 2], [1, 37, 4], [1, 38, 1], [1, 39, 4], [1, 40, 3], [1, 41, 3], [1, 42, 6], [1, 43, 4], [1, 44, 8], [1, 45, 7], [1, 46, 3], [1, 48, 5], [1, 49, 8], [1, 50, 6], [1, 51, 1], [1, 52, 5], [1, 54, 8], [1, 55, 9], [1, 56, 7], [1, 57, 7], [1, 58, 7], [1, 59, 9], [1, 60, 3], [1, 61, 9], [1, 62, 4], [1, 63, 8], [1, 64, 8], [1, 65, 4], [1, 66, 7], [1, 67, 3], [1, 68, 6], [1, 69, 7], [1, 70, 1], [1, 71, 4], [1, 72, 4], [1, 74, 2], [1, 75, 2], [1, 76, 1], [1, 77, 2], [1, 78, 2], [1, 79, 8], [1, 80, 5], [1, 81, 3], [1, 82, 7], [1, 83, 9], [1, 84, 5], [1, 85, 2], [1, 87, 1], [1, 88, 3], [1, 89, 7], [1, 90, 9], [1, 91, 6], [1, 92, 9], [1, 93, 5], [1, 94, 1], [1, 95, 6], [1, 96, 2], [1, 97, 2], [1, 98, 1], [1, 99, 1], [1, 100, 9], [1, 101, 1], [1, 102, 7], [1, 103, 3], [1, 104, 9], [1, 105, 5], [1, 106, 2], [1, 107, 3], [1, 108, 8], [1, 109, 6], [1, 110, 2], [1, 111, 6], [1, 112, 1], [1, 113, 3], [1, 114, 4], [1, 115, 3], [1, 116, 2], [1, 117, 7], [1, 118, 5], [1, 119, 1], [1, 120, 1], [1, 121, 1], [1, 122, 1], [1, 123, 5], [1, 124, 6], [1, 125, 7], [1, 126, 4], [1, 127, 3], [1, 128, 2], [2, 0, 2], [2, 8, 7], [2, 9, 9], [2, 14, 6], [2, 16, 4], [2, 19, 4], [2, 21, 7], [2, 23, 5], [2, 26, 2], [2, 28, 7], [2, 29, 6], [2, 31, 2], [2, 38, 4], [2, 45, 9], [2, 46, 5], [2, 48, 3], [2, 49, 5], [2, 50, 8], [2, 51, 5], [2, 54, 4], [2, 55, 3], [2, 58, 9], [2, 59, 6], [2, 60, 8], [2, 61, 3], [2, 62, 2], [2, 67, 8], [2, 68, 2], [2, 69, 9], [2, 72, 7], [2, 75, 1], [2, 76, 9], [2, 77, 6], [2, 78, 3], [2, 79, 7], [2, 80, 3], [2, 88, 4], [2, 89, 8], [2, 90, 8], [2, 91, 9], [2, 100, 7], [2, 101, 9], [2, 102, 1], [2, 103, 5], [2, 105, 3], [2, 106, 9], [2, 107, 7], [2, 109, 4], [2, 110, 7], [2, 111, 4], [2, 112, 5], [2, 113, 4], [2, 119, 2], [2, 120, 2], [2, 121, 2], [2, 124, 1], [2, 126, 1], [3, 19, 8], [3, 26, 5], [3, 28, 6], [3, 48, 7], [3, 49, 3], [3, 50, 9], [3, 54, 2], [3, 59, 4], [3, 67, 9], [3, 69, 4], [3, 72, 8], [3, 75, 3], [3, 77, 3], [3, 79, 1], [3, 89, 4], [3, 102, 6], [3, 103, 8], [3, 105, 4], [3, 107, 2], [3, 109, 8], [3, 110, 5], [3, 111, 8], [3, 112, 6], [3, 113, 8], [3, 119, 3], [3, 120, 3], [3, 121, 3], [4, 19, 7], [4, 26, 9], [4, 48, 6], [4, 49, 7], [4, 72, 2], [4, 102, 2], [4, 103, 1], [4, 107, 9], [4, 109, 1], [4, 110, 8], [4, 111, 5], [4, 112, 9], [4, 113, 2], [4, 119, 4], [4, 120, 4], [4, 121, 4], [5, 19, 3], [5, 72, 3], [5, 102, 5], [5, 109, 3], [5, 111, 9], [5, 112, 4], [5, 113, 6], [5, 119, 5], [5, 120, 5], [5, 121, 5], [6, 119, 6], [6, 120, 6], [6, 121, 6], [7, 119, 7], [7, 120, 7], [7, 121, 7], [8, 119, 8], [8, 120, 8], [8, 121, 8], [9, 119, 9], [9, 120, 9], [9, 121, 9]]
+    return [ObjectiveValue, Timetable(Current.XSet(), YSet)]
+
+
+# Keep a single TimetableModel and reuse it for every call to HillClimber.  If no course section
+# is free to move, use the much smaller student sectioning model instead.
+
+Model = None
+
+def HillClimber(Current, FixedNumber, Cutoff=None, Incumbent=None, FreeSections=None):
+    global Model
+    if FixedNumber == 0:
+        return SectionStudents(Current, Cutoff)
+    if Model is None:
+        Model = TimetableModel()
+    return Model.Solve(Current, FixedNumber, Cutoff, Incumbent, FreeSections)
+
+
+# Without a pre-loaded timetable, Iteration 0 starts in two stages.  First, a timetable of the
+# course sections that satisfies CONSTRAINTS 1-8 is built, by GreedyTimetable (see below) or by
+# CourseTimetable, which finds any such timetable using only the x[s,j,k] variables.  If the
+# greedy constructor gets stuck, CourseTimetable is used instead.  SectionStudents then assigns
+# the students to it, and the hill-climbing iterations improve the timetable from there.
+
+def CourseTimetable():
+
+    solver = CreateSolver()
+    Metrics = ModelMetrics(solver)
+
+    x = {}
+    for (s,j,k) in XKeys:
+        x[s,j,k] = solver.IntVar(0,1, 'x[%d,%d,%d]' % (s,j,k))
+    Metrics.Mark("x variables")
+
+    AddCourseConstraints(solver, x, Metrics)
+    Metrics.Log("build", CountNonzeros=True, model="CourseTimetable")
+
+    Status = RunSolver(solver)
+    Metrics.Mark("solve")
+    Metrics.Log("solve", model="CourseTimetable", status=StatusNames.get(Status, Status))
+    if Status not in SolvedStatuses:
+        return None
+    # The x[s,j,k] are the only variables of this model, created in the order of x.
+    return Timetable(np.array(list(x), dtype=int)[SolutionValues(solver) > 0.5])
+
+def ColdStart(Method):
+    Sections = None
+    if Method == "greedy":
+        Sections = GreedyTimetable()
+        if Sections is None:
+            print("The greedy timetable got stuck: using an Integer Linear Program instead")
+    if Sections is None:
+        Sections = CourseTimetable()
+    if Sections is None:
+        return None
+    return SectionStudents(Sections)
+
+
+# Parallel search.  With --workers N > 1, every iteration solves Neighbourhoods differently
+# seeded neighbourhoods of the current timetable in N worker processes, and adopts the best of
+# them.  Each worker builds its own TimetableModel (and so its own solver) the first time it is
+# used.  The workers share the score to beat through SharedIncumbent: one more than the current
+# objective at the start of the iteration, and then the best objective found so far.  Each
+# neighbourhood reads it when its solve starts (a solve that is already running cannot see it)
+# and only looks for timetables that score at least as much, so once one neighbourhood has found
+# an improvement, a later neighbourhood that cannot match it is cut off as soon as the solver
+# proves this.  Timetables that tie with SharedIncumbent are still returned, so the best result
+# of an iteration, and the first neighbourhood that reaches it, do not depend on which worker
+# finishes first (as long as no solve stops at the --time-limit).
+
+def InitializeWorker(Incumbent):
+    global Model, SharedIncumbent
+    Model = None
+    SharedIncumbent = Incumbent
+
+def SolveNeighbourhood(Task):
+    Index, Current, FixedNumber, WorkerSeed, Incumbent, FreeSections, Iteration = Task
+    seed(WorkerSeed)
+    MetricsContext["iteration"] = Iteration
+    Result = HillClimber(Current, FixedNumber, Cutoff=SharedIncumbent.value,
+                         Incumbent=Incumbent, FreeSections=FreeSections)
+    if Result is not None:
+        with SharedIncumbent.get_lock():
+            if Result[0] > SharedIncumbent.value:
+                SharedIncumbent.value = Result[0]
+    return [Index, Result]
+
+
+# Fast move screening.  MoveEvaluator keeps a copy of a Timetable, the blocks in which every course
+# is offered and, for every student i and block k, BlockLoad[i,k], the number of student i's
+# requested courses that have a section in block k.  Evaluate(s,j,k) estimates, in about a
+# millisecond, how the number of satisfied requests and the total preference points change if
+# section s of course j moves to block k, and checks the move against CONSTRAINTS 2-8.
+#
+# The estimate ignores the room capacity, study block, IEP and balancing constraints: for each
+# student who requested course j, it finds the best assignment of their requested courses to
+# distinct blocks in which those courses are offered.  Taking the courses in order of decreasing
+# preference and keeping each one that fits (possibly by moving earlier courses to other offered
+# blocks) gives an assignment with the most preference points.
+
+# For each course j, let RankedChoices be the students' requested courses with P[i,j] > 0 from the
+# highest to the lowest preference, CourseTeachers[j] the teachers in TeacherCourses who teach it,
+# CourseRooms[j] the room sets in RoomCourses that course j belongs to, and CourseDepartment[j] the
+# department index of course j for CONSTRAINT 7 (or None).
+
+RankedChoices = [sorted((j for j in set(StudentChoices[i]) if P[i,j] > 0), key=lambda j: -P[i,j])
+                 for i in range(n)]
+
+CourseTeachers = [[] for j in range(m)]
+for t in range(len(TeacherList)):
+    for j in set(TeacherCourses[t]):
+        CourseTeachers[j].append(t)
+
+CourseRooms = [[] for j in range(m)]
+for Rooms in RoomCourses:
+    for j in RoomCourses[Rooms]:
+        CourseRooms[j].append(Rooms)
+
+CourseDepartment = [None for j in range(m)]
+for d in range(5):
+    for j in DepartmentCourses[d]:
+        CourseDepartment[j] = d
+
+RequiredSections = set((z[0], z[1]) for z in RequiredAssignments)
+
+CalculusCourses = [CourseLookup["AP Calculus AB"], CourseLookup["AP Calculus BC"],
+                   CourseLookup["Calculus 12"]]
+PhysicsCourse = CourseLookup["Physics 12"]
+
+
+class MoveEvaluator:
+
+    def __init__(self, Current):
+        self.Current = Current.Copy()
+        self.OfferedBlocks = [[] for j in range(m)]
+        self.BlockSections = [[] for k in range(10)]
+        self.BlockLoad = np.zeros((n, 10), dtype=int)
+        for [s,j,k] in Current.XSet():
+            self.OfferedBlocks[j].append(k)
+            self.BlockSections[k].append([s,j])
+            self.BlockLoad[CourseRequesters[j], k] += 1
+        self.StudentScore = [self.MatchStudent(i) for i in range(n)]
+
+    # Return [Count, Points] for the best assignment of student i's requests to offered blocks.
+    def MatchStudent(self, i):
+        BlockOwner = {}
+        Count = 0
+        Points = 0
+        for j in RankedChoices[i]:
+            if self.Augment(j, BlockOwner, set()):
+                Count += 1
+                Points += int(P[i,j])
+        return [Count, Points]
+
+    def Augment(self, j, BlockOwner, Visited):
+        for k in self.OfferedBlocks[j]:
+            if k not in Visited:
+                Visited.add(k)
+                if k not in BlockOwner or self.Augment(BlockOwner[k], BlockOwner, Visited):
+                    BlockOwner[k] = j
+                    return True
+        return False
+
+    # For course j, count the students who requested j and have another requested course offered
+    # in each block k (entry 0 is unused, as with the block numbers everywhere else).
+    def ConflictCounts(self, j):
+        Load = self.BlockLoad[CourseRequesters[j]].copy()
+        for k in self.OfferedBlocks[j]:
+            Load[:, k] -= 1
+        return np.count_nonzero(Load > 0, axis=0)
+
+    # Return None if section s of course j can move to block k, or the reason why it cannot.
+    def CheckMove(self, s, j, k):
+        if (s,j) in RequiredSections:
+            return "section is a required assignment"
+        if not BlockMask[j,k]:
+            return "block ruled out by the rules"
+        if k in self.OfferedBlocks[j]:
+            return "course already offered in this block"
+        Others = [Section[1] for Section in self.BlockSections[k]]
+        for t in CourseTeachers[j]:
+            if any(Other in TeacherCourses[t] for Other in Others):
+                return "teacher " + TeacherList[t] + " already teaches in this block"
+        for Rooms in CourseRooms[j]:
+            if sum(1 for Other in Others if Other in RoomCourses[Rooms]) >= len(Rooms):
+                return "no free room in " + "/".join(Rooms) + " in this block"
+        d = CourseDepartment[j]
+        if d is not None and sum(1 for Other in Others if CourseDepartment[Other] == d) >= 5:
+            return "too many " + Departments[d] + " courses in this block"
+        if j in CalculusCourses:
+            return "calculus courses must move together"
+        if j == PhysicsCourse and any(Other in CalculusCourses for Other in Others):
+            return "Physics 12 cannot be offered with the calculus courses"
+        return None
+
+    # Return [DeltaRequests, DeltaPoints], the estimated change in satisfied requests and in
+    # preference points if section s of course j moves to block k.
+    def EstimateMove(self, s, j, k):
+        OldBlock = int(self.Current.SectionBlock[s,j])
+        Blocks = self.OfferedBlocks[j]
+        self.OfferedBlocks[j] = [k if Block == OldBlock else Block for Block in Blocks]
+        DeltaRequests = 0
+        DeltaPoints = 0
+        for i in CourseRequesters[j]:
+            Count, Points = self.MatchStudent(i)
+            DeltaRequests += Count - self.StudentScore[i][0]
+            DeltaPoints += Points - self.StudentScore[i][1]
+        self.OfferedBlocks[j] = Blocks
+        return [DeltaRequests, DeltaPoints]
+
+    # Return the CoRequest weight between course j and the other courses offered in block k.
+    def CoRequestWeight(self, j, k):
+        Others = [Section[1] for Section in self.BlockSections[k] if Section[1] != j]
+        return int(CoRequest[j, Others].sum())
+
+    # Return [DeltaRequests, DeltaPoints, Reason], where Reason is None if the move is feasible.
+    def Evaluate(self, s, j, k):
+        return self.EstimateMove(s, j, k) + [self.CheckMove(s, j, k)]
+
+    # Make the move permanent.
+    def Apply(self, s, j, k):
+        OldBlock = int(self.Current.SectionBlock[s,j])
+        self.Current.Move(s, j, k)
+        self.OfferedBlocks[j] = [k if Block == OldBlock else Block for Block in self.OfferedBlocks[j]]
+        self.BlockSections[OldBlock].remove([s,j])
+        self.BlockSections[k].append([s,j])
+        self.BlockLoad[CourseRequesters[j], OldBlock] -= 1
+        self.BlockLoad[CourseRequesters[j], k] += 1
+        for i in CourseRequesters[j]:
+            self.StudentScore[i] = self.MatchStudent(i)
+
+    # Evaluate every feasible single-section move and return them as [DeltaPoints, DeltaRequests,
+    # s, j, k], best first.  Of two moves with the same estimate, the one into the block with the
+    # smaller CoRequestWeight comes first.
+    def ScreenMoves(self):
+        Moves = []
+        S, J, K = self.Current.Sections()
+        for s, j in zip(S.tolist(), J.tolist()):
+            for k in CourseBlocks[j]:
+                if self.CheckMove(s, j, k) is None:
+                    DeltaRequests, DeltaPoints = self.EstimateMove(s, j, k)
+                    Moves.append([DeltaPoints, DeltaRequests, -self.CoRequestWeight(j, k), s, j, k])
+        Moves.sort(reverse=True)
+        return [Move[:2] + Move[3:] for Move in Moves]
+
+
+# Co-requests.  CoRequest[j1,j2] is the number of preference points at stake when course j1 and
+# course j2 share a block: for every student who requested both courses, the smaller of P[i,j1]
+# and P[i,j2], since a student in a single section of each can only take one of them.
+
+CoRequest = np.zeros((m, m), dtype=int)
+for i in range(n):
+    Choices = RankedChoices[i]
+    Points = P[i, Choices]
+    CoRequest[np.ix_(Choices, Choices)] += np.minimum.outer(Points, Points)
+np.fill_diagonal(CoRequest, 0)
+
+
+# Greedy start.  GreedyTimetable colours the course sections with the blocks, in the way of the
+# DSatur graph colouring heuristic on the CoRequest graph.  The required sections are placed first
+# and then the section 1 of each calculus course, all in one block (CONSTRAINT 8).  Every other
+# section is placed one at a time: the next section is always one of the course with the fewest
+# blocks left that keep CONSTRAINTS 2-8 (ties go to the course with the most CoRequest weight),
+# and it goes into the block where it shares the least CoRequest weight with the courses already
+# there.  GreedyTimetable returns None if some section has no block left.
+
+def GreedyTimetable():
+
+    XSet = []
+    BlockCourses = [[] for k in range(10)]
+    BusyTeachers = [set() for k in range(10)]
+    RoomUse = defaultdict(int)
+    DepartmentUse = defaultdict(int)
+    Degree = CoRequest.sum(axis=1)
+
+    # CONSTRAINTS 2, 3, 6, 7 and the Physics 12 half of CONSTRAINT 8 for course j in block k.
+    def Fits(j, k):
+        if j in BlockCourses[k]:
+            return False
+        if any(t in BusyTeachers[k] for t in CourseTeachers[j]):
+            return False
+        if any(RoomUse[Rooms,k] >= len(Rooms) for Rooms in CourseRooms[j]):
+            return False
+        d = CourseDepartment[j]
+        if d is not None and DepartmentUse[d,k] >= 5:
+            return False
+        if j == PhysicsCourse and any(Other in BlockCourses[k] for Other in CalculusCourses):
+            return False
+        if j in CalculusCourses and PhysicsCourse in BlockCourses[k]:
+            return False
+        return True
+
+    def Place(s, j, k):
+        XSet.append([s,j,k])
+        BlockCourses[k].append(j)
+        BusyTeachers[k].update(CourseTeachers[j])
+        for Rooms in CourseRooms[j]:
+            RoomUse[Rooms,k] += 1
+        if CourseDepartment[j] is not None:
+            DepartmentUse[CourseDepartment[j],k] += 1
+
+    def Remove(s, j, k):
+        XSet.remove([s,j,k])
+        BlockCourses[k].remove(j)
+        BusyTeachers[k].difference_update(CourseTeachers[j])
+        for Rooms in CourseRooms[j]:
+            RoomUse[Rooms,k] -= 1
+        if CourseDepartment[j] is not None:
+            DepartmentUse[CourseDepartment[j],k] -= 1
+
+    def Weight(j, k):
+        return (int(CoRequest[j, BlockCourses[k]].sum()), len(BlockCourses[k]), k)
 
+    for z in RequiredAssignments:
+        Place(z[0], z[1], z[2])
+
+    # The calculus courses go into the first block that fits all of them (and that holds any of
+    # them that are required), tried from the least to the most CoRequest weight.
+    Free = [[s,j] for j in range(m) for s in range(1, CourseSections[j]+1)
+            if s not in RequiredBlocks[j]]
+    Calculus = [j for j in CalculusCourses if [1,j] in Free]
+    if Calculus:
+        Candidates = set(range(1, 10))
+        for j in CalculusCourses:
+            if j in Calculus:
+                Candidates &= set(CourseBlocks[j])
+            elif 1 in RequiredBlocks[j]:
+                Candidates &= set([RequiredBlocks[j][1]])
+        for k in sorted(Candidates, key=lambda k: (sum(Weight(j, k)[0] for j in Calculus), k)):
+            Placed = []
+            for j in Calculus:
+                if Fits(j, k):
+                    Place(1, j, k)
+                    Placed.append(j)
+            if len(Placed) == len(Calculus):
+                break
+            for j in Placed:
+                Remove(1, j, k)
+        else:
+            return None
+        Free = [[s,j] for [s,j] in Free if not (s == 1 and j in Calculus)]
+
+    while Free:
+        Blocks = {}
+        for [s,j] in Free:
+            if j not in Blocks:
+                Blocks[j] = [k for k in CourseBlocks[j] if Fits(j, k)]
+        j = min(Blocks, key=lambda j: (len(Blocks[j]), -Degree[j], j))
+        if not Blocks[j]:
+            return None
+        s = min(s for [s,Course] in Free if Course == j)
+        Place(s, j, min(Blocks[j], key=lambda k: Weight(j, k)))
+        Free.remove([s,j])
+
+    return Timetable(XSet)
 
-# Moved Pre-Calc 12 from 1C to 2B
-XSet.remove([1,103,3])
-XSet.append([1,103,6])
 
+# Pre-load the best timetable found so far
 
-# Moved Socials 8 from 2E to 2D
+XSet = [[1, 0, 8], [1, 1, 1], [1, 2, 3], [1, 3, 3], [1, 4, 2], [1, 5, 4], [1, 6, 6], [1, 7, 9], [1, 8, 5], [1, 9, 6], [1, 10, 6], [1, 11, 8], [1, 12, 7], [1, 13, 8], [1, 14, 1], [1, 15, 9], [1, 16, 2], [1, 18, 7], [1, 19, 9], [1, 20, 9], [1, 21, 4], [1, 23, 2], [1, 25, 3], [1, 26, 4], [1, 27, 4], [1, 28, 8], [1, 29, 4], [1, 31, 9], [1, 32, 2], [1, 33, 6], [1, 34, 1], [1, 35, 5], [1, 36, 2], [1, 37, 4], [1, 38, 1], [1, 39, 4], [1, 40, 3], [1, 41, 3], [1, 42, 6], [1, 43, 4], [1, 44, 8], [1, 45, 7], [1, 46, 3], [1, 48, 5], [1, 49, 8], [1, 50, 6], [1, 51, 1], [1, 52, 5], [1, 54, 8], [1, 55, 9], [1, 56, 7], [1, 57, 7], [1, 58, 7], [1, 59, 9], [1, 60, 3], [1, 61, 9], [1, 62, 4], [1, 63, 8], [1, 64, 8], [1, 65, 4], [1, 66, 7], [1, 67, 3], [1, 68, 6], [1, 69, 7], [1, 70, 1], [1, 71, 4], [1, 72, 4], [1, 74, 2], [1, 75, 2], [1, 76, 1], [1, 77, 2], [1, 78, 2], [1, 79, 8], [1, 80, 5], [1, 81, 3], [1, 82, 7], [1, 83, 9], [1, 84, 5], [1, 85, 2], [1, 87, 1], [1, 88, 3], [1, 89, 7], [1, 90, 9], [1, 91, 6], [1, 92, 9], [1, 93, 5], [1, 94, 1], [1, 95, 6], [1, 96, 2], [1, 97, 2], [1, 98, 1], [1, 99, 1], [1, 100, 9], [1, 101, 1], [1, 102, 7], [1, 103, 3], [1, 104, 9], [1, 105, 5], [1, 106, 2], [1, 107, 3], [1, 108, 8], [1, 109, 6], [1, 110, 2], [1, 111, 6], [1, 112, 1], [1, 113, 3], [1, 114, 4], [1, 115, 3], [1, 116, 2], [1, 117, 7], [1, 118, 5], [1, 119, 1], [1, 120, 1], [1, 121, 1], [1, 122, 1], [1, 123, 5], [1, 124, 6], [1, 125, 7], [1, 126, 4], [1, 127, 3], [1, 128, 2], [2, 0, 2], [2, 8, 7], [2, 9, 9], [2, 14, 6], [2, 16, 4], [2, 19, 4], [2, 21, 7], [2, 23, 5], [2, 26, 2], [2, 28, 7], [2, 29, 6], [2, 31, 2], [2, 38, 4], [2, 45, 9], [2, 46, 5], [2, 48, 3], [2, 49, 5], [2, 50, 8], [2, 51, 5], [2, 54, 4], [2, 55, 3], [2, 58, 9], [2, 59, 6], [2, 60, 8], [2, 61, 3], [2, 62, 2], [2, 67, 8], [2, 68, 2], [2, 69, 9], [2, 72, 7], [2, 75, 1], [2, 76, 9], [2, 77, 6], [2, 78, 3], [2, 79, 7], [2, 80, 3], [2, 88, 4], [2, 89, 8], [2, 90, 8], [2, 91, 9], [2, 100, 7], [2, 101, 9], [2, 102, 1], [2, 103, 5], [2, 105, 3], [2, 106, 9], [2, 107, 7], [2, 109, 4], [2, 110, 7], [2, 111, 4], [2, 112, 5], [2, 113, 4], [2, 119, 2], [2, 120, 2], [2, 121, 2], [2, 124, 1], [2, 126, 1], [3, 19, 8], [3, 26, 5], [3, 28, 6], [3, 48, 7], [3, 49, 3], [3, 50, 9], [3, 54, 2], [3, 59, 4], [3, 67, 9], [3, 69, 4], [3, 72, 8], [3, 75, 3], [3, 77, 3], [3, 79, 1], [3, 89, 4], [3, 102, 6], [3, 103, 8], [3, 105, 4], [3, 107, 2], [3, 109, 8], [3, 110, 5], [3, 111, 8], [3, 112, 6], [3, 113, 8], [3, 119, 3], [3, 120, 3], [3, 121, 3], [4, 19, 7], [4, 26, 9], [4, 48, 6], [4, 49, 7], [4, 72, 2], [4, 102, 2], [4, 103, 1], [4, 107, 9], [4, 109, 1], [4, 110, 8], [4, 111, 5], [4, 112, 9], [4, 113, 2], [4, 119, 4], [4, 120, 4], [4, 121, 4], [5, 19, 3], [5, 72, 3], [5, 102, 5], [5, 109, 3], [5, 111, 9], [5, 112, 4], [5, 113, 6], [5, 119, 5], [5, 120, 5], [5, 121, 5], [6, 119, 6], [6, 120, 6], [6, 121, 6], [7, 119, 7], [7, 120, 7], [7, 121, 7], [8, 119, 8], [8, 120, 8], [8, 121, 8], [9, 119, 9], [9, 120, 9], [9, 121, 9]]
 
-XSet.remove([4,112,9])
-XSet.append([4,112,8])
 
-# Now use the Initial Timetable (XSet) of just the course/section assignments to blocks
-# to generate the YSet, the optimal assignment of students to courses and blocks for this timetable.
+if SchoolData:
+    Preloaded = Timetable(XSet)
+
+
+    # Moved Pre-Calc 12 from 1C to 2B
+    Preloaded.Move(1,103,6)
+
+
+    # Moved Socials 8 from 2E to 2D
+
+    Preloaded.Move(4,112,8)
+
+# Checkpoints.  The state of the search is saved in CheckpointFile after Iteration 0 and after
+# every hill-climbing iteration, so that an interrupted search can carry on with --resume from the
+# last iteration it finished, without solving Iteration 0 again.  A checkpoint holds the Iteration
+# 0, current and best timetables (each as [objective, Timetable]), the iteration counter, the
+# number of iterations without an improvement, BaseSeed and the state of the random number
+# generator, the time used so far, and the hash of the input file that it belongs to.  It is
+# written to a temporary file first, so a crash while saving never leaves a broken checkpoint.
+
+CheckpointVersion = 2
+CheckpointFile = Options.checkpoint
+
+def SaveCheckpoint(State):
+    State = dict(State, version=CheckpointVersion, input=InputKey[1:])
+    try:
+        file = open(CheckpointFile + ".tmp", 'wb')
+        pickle.dump(State, file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.close()
+        os.replace(CheckpointFile + ".tmp", CheckpointFile)
+    except OSError:
+        print("Could not write the checkpoint", CheckpointFile)
+
+def LoadCheckpoint():
+    try:
+        file = open(CheckpointFile, 'rb')
+        State = pickle.load(file)
+        file.close()
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        raise SystemExit("ERROR! Could not read the checkpoint " + CheckpointFile)
+    if not isinstance(State, dict) or State.get("version") != CheckpointVersion:
+        raise SystemExit("ERROR! " + CheckpointFile + " is not a checkpoint of this version")
+    if State["input"] != InputKey[1:]:
+        raise SystemExit("ERROR! " + CheckpointFile
+                         + " was saved for a different input or rules file")
+    return State
+
+# With --resume, carry on with the search saved in CheckpointFile.  Otherwise, use the Preloaded
+# timetable of just the course/section assignments to blocks to generate the YSet, the optimal
+# assignment of students to courses and blocks for this timetable.
+
+if Options.resume:
+    Checkpoint = LoadCheckpoint()
+    start_time = time.time() - Checkpoint["seconds"]
+    ObjectiveValue, Initial = Checkpoint["initial"]
+    print("Resuming the search from", CheckpointFile, "after Iteration", Checkpoint["iteration"],
+          "with", Checkpoint["best"][0], "points")
+else:
+    seed(Options.seed)
+    start_time = time.time()
+    MetricsContext["iteration"] = 0
+    if InitialMethod == "preloaded":
+        FirstIteration = HillClimber(Preloaded, 0)
+    else:
+        FirstIteration = ColdStart(InitialMethod)
+    if FirstIteration is None:
+        raise SystemExit("ERROR! No timetable found in Iteration 0")
+    ObjectiveValue, Initial = FirstIteration
+    Satisfied = int(np.count_nonzero(Initial.StudentBlock))
+    solving_time = round(time.time() - start_time)
+    LogMetrics("iteration", seconds=round(time.time() - start_time, 3), objective=ObjectiveValue,
+               requests=Satisfied)
+
+    print("Iteration 0 complete in", solving_time, "seconds with", ObjectiveValue, "points and", 
+          Satisfied, "student requests satisfied")
+
+
+# Hill-climbing search.  In each iteration, let FixedNumber randomly chosen course sections of
+# the current timetable move to other blocks (see CONSTRAINT 16) and keep the new timetable only
+# if it scores more points than the current one.  After RestartAfter iterations in a row without
+# an improvement, restart the climb from the Iteration 0 timetable.  The search stops after
+# MaxIterations iterations or TimeBudget seconds, whichever comes first, and the best timetable
+# over all restarts is the one we report below.
+
+FixedNumber = Options.fixed_number
+MaxIterations = Options.iterations
+TimeBudget = Options.time_budget
+RestartAfter = Options.restart_after
+Workers = Options.workers
+Neighbourhoods = Options.neighbourhoods if Options.neighbourhoods > 0 else 2 * Workers
+WarmStart = not Options.no_warm_start
+ScreenMoves = Options.screen_moves
+
+# Every neighbourhood gets a deterministic seed built from BaseSeed, the iteration number and
+# the neighbourhood number, so a run with --seed can be reproduced exactly.  Use the fork start method
+# so the workers inherit all of the input data parsed above.
+
+BaseSeed = Options.seed if Options.seed is not None else randrange(2**31)
+if Workers > 1:
+    SharedIncumbent = multiprocessing.Value('d', ObjectiveValue)
+    WorkerPool = multiprocessing.get_context("fork").Pool(Workers, initializer=InitializeWorker,
+                                                          initargs=(SharedIncumbent,))
+
+InitialTimetable = [ObjectiveValue, Initial]
+CurrentObjective, Current = InitialTimetable
+BestObjective, Best = InitialTimetable
+Iteration = 0
+Stalled = 0
+if Options.resume:
+    CurrentObjective, Current = Checkpoint["current"]
+    BestObjective, Best = Checkpoint["best"]
+    Iteration = Checkpoint["iteration"]
+    Stalled = Checkpoint["stalled"]
+    BaseSeed = Checkpoint["base_seed"]
+    setstate(Checkpoint["rng"])
+
+def SearchState():
+    return {"initial": InitialTimetable, "current": [CurrentObjective, Current],
+            "best": [BestObjective, Best], "iteration": Iteration,
+            "stalled": Stalled, "base_seed": BaseSeed, "rng": getstate(),
+            "seconds": time.time() - start_time}
+
+SaveCheckpoint(SearchState())
+
+while Iteration < MaxIterations:
+    if TimeBudget > 0 and time.time() - start_time >= TimeBudget:
+        print("Time budget of", TimeBudget, "seconds used up after", Iteration, "iterations")
+        break
+    Iteration += 1
+    iteration_start = time.time()
+    MetricsContext["iteration"] = Iteration
+    Incumbent = [CurrentObjective, Current] if WarmStart else None
+
+    # With --screen-moves, free the course sections of the most promising single-section moves
+    # and let the shuffle fill up the rest of the FixedNumber free sections.
+    FreeSections = None
+    if ScreenMoves > 0:
+        Moves = MoveEvaluator(Current).ScreenMoves()
+        FreeSections = []
+        for [DeltaPoints, DeltaRequests, s, j, k] in Moves[:ScreenMoves]:
+            if DeltaPoints > 0 and [s,j] not in FreeSections:
+                FreeSections.append([s,j])
+
+    if Workers > 1:
+        SharedIncumbent.value = CurrentObjective + 1
+        Tasks = [(w, Current, FixedNumber, "%d-%d-%d" % (BaseSeed, Iteration, w),
+                  Incumbent, FreeSections, Iteration) for w in range(Neighbourhoods)]
+        Results = sorted([Index, R] for [Index, R] in
+                         WorkerPool.imap_unordered(SolveNeighbourhood, Tasks) if R is not None)
+        NextIteration = max([R for [Index, R] in Results], key=lambda R: R[0]) if Results else None
+    else:
+        NextIteration = HillClimber(Current, FixedNumber, Incumbent=Incumbent,
+                                    FreeSections=FreeSections)
+    solving_time = round(time.time() - iteration_start)
+
+    Accepted = NextIteration is not None and NextIteration[0] > CurrentObjective
+    if Accepted:
+        CurrentObjective, Current = NextIteration
+        Stalled = 0
+        if CurrentObjective > BestObjective:
+            BestObjective, Best = NextIteration
+    else:
+        Stalled += 1
+    LogMetrics("iteration", seconds=round(time.time() - iteration_start, 3),
+               objective=NextIteration[0] if NextIteration is not None else None,
+               accepted=Accepted, current=CurrentObjective, best=BestObjective)
+
+    if NextIteration is None:
+        print("Iteration", Iteration, "complete in", solving_time, "seconds with no improving timetable",
+              "(current", CurrentObjective, "points, best", BestObjective, "points)")
+    else:
+        print("Iteration", Iteration, "complete in", solving_time, "seconds with", NextIteration[0],
+              "points (current", CurrentObjective, "points, best", BestObjective, "points)")
+
+    if RestartAfter > 0 and Stalled >= RestartAfter:
+        print("No improvement in", Stalled, "iterations: restarting from the Iteration 0 timetable")
+        CurrentObjective, Current = InitialTimetable
+        Stalled = 0
 
-start_time = time.time()
-FirstIteration = HillClimber(XSet, 0)
-ObjectiveValue = FirstIteration[0]
-XSet = FirstIteration[1]
-YSet = FirstIteration[2]
-solving_time = round(time.time() - start_time)
+    SaveCheckpoint(SearchState())
 
-print("Iteration 0 complete in", solving_time, "seconds with", ObjectiveValue, "points and", 
-      len(YSet), "student requests satisfied")
+if Workers > 1:
+    WorkerPool.close()
+    WorkerPool.join()
 
-file = open('CS5100_XSet.txt', 'w')
-file.write(str(XSet))
-file.close()
-file = open('CS5100_YSet.txt', 'w')
-file.write(str(YSet))
-file.close()
+ObjectiveValue = BestObjective
+XSet = Best.XSet()
 
 # Generate the statistics for our Master Timetable, to see how well our timetable
 # assigned students to their requested courses.
 
+# Index the final timetable once, so that none of the statistics below has to scan YSet.
+# YStudents, YCourses and YBlocks list the [i,j,k] of the Best timetable, and XArray has one
+# [s,j,k] row for each of its course sections.
+# Enrollment[j,k] is the number of students in course j in block k, and GradeEnrollment[g,k],
+# GenderEnrollment[j,k] (a [female, male] pair) and IEPEnrollment[j,k] break those students
+# down by grade, gender and IEP flag.  InGrade[g,i] is 1 if student i is in StudentsPerGrade[g]
+# (a student can be listed in two grades) and StudentBlocks[i,k] is 1 if student i takes a course
+# in block k.
+
 Courses = range(m)
-TotalRequests = [0 for g in range(13)]
-TotalAssignments = [0 for g in range(13)]
+YStudents, YCourses, YBlocks = Best.Assignments()
+XArray = np.column_stack(Best.Sections())
 
+InGrade = np.zeros((13, n), dtype=int)
 for g in range(13):
-    for i in StudentsPerGrade[g]:
-        for j in Courses:
-            if P[i][j]>0: 
-                TotalRequests[g] += 1
-    for y in YSet:
-        i = y[0]
-        j = y[1]
-        if i in StudentsPerGrade[g]:
-            TotalAssignments[g] += 1
+    InGrade[g, StudentsPerGrade[g]] = 1
+StudentBlocks = np.zeros((n, 10), dtype=int)
+np.add.at(StudentBlocks, (YStudents, YBlocks), 1)
+
+Enrollment = np.zeros((m, 10), dtype=int)
+np.add.at(Enrollment, (YCourses, YBlocks), 1)
+GradeEnrollment = InGrade @ StudentBlocks
+GenderEnrollment = np.zeros((m, 10, 2), dtype=int)
+np.add.at(GenderEnrollment, (YCourses, YBlocks, GenderInfo[YStudents]), 1)
+IEPEnrollment = np.zeros((m, 10), dtype=int)
+np.add.at(IEPEnrollment, (YCourses, YBlocks), IEP[YStudents, YCourses].astype(int))
+
+StudentRequests = np.count_nonzero(P > 0, axis=1)
+TotalRequests = (InGrade @ StudentRequests).tolist()
+TotalAssignments = GradeEnrollment.sum(axis=1).tolist()
 
 print("Statistics for Our Master Timetable for the entire WPGA Senior School:")
 print(sum(TotalAssignments), "out of", sum(TotalRequests), "total courses satisfied:",
@@ -746,74 +1928,64 @@ for g in [12,11,10,9,8]:
     print(TotalAssignments[g], "out of", TotalRequests[g], "total courses satisfied:",
           round(100*TotalAssignments[g]/TotalRequests[g],2), "percent")
 
+# A request [j,i] is missed unless it is matched to one of student i's assignments in YSet.
+# Each assignment matches only one request, as a student may request the same course twice.
+
+Unmatched = set(zip(YStudents.tolist(), YCourses.tolist()))
 MissedCourses = []
 for i in range(n):
     for j in StudentChoices[i]:
-        if P[i][j]>0:
-            MissedCourses.append([j,i])
-        
-for i in range(len(YSet)):
-    if P[YSet[i][0]][YSet[i][1]]>0:
-        if [YSet[i][1], YSet[i][0]] in MissedCourses:
-            MissedCourses.remove([YSet[i][1], YSet[i][0]])
+        if P[i,j]>0:
+            if (i,j) in Unmatched:
+                Unmatched.remove((i,j))
+            else:
+                MissedCourses.append([j,i])
     
 MissedCourses.sort()
 
 print("Total Missed Courses:", len(MissedCourses))
 print("")
 BlockList = ["","1A","1B","1C","1D","2A","2B","2C","2D","2E"]
+OfferedBlocks = [[] for j in Courses]
+for x in XSet:
+    OfferedBlocks[x[1]].append(BlockList[x[2]])
+
 for mypair in MissedCourses:
     
     j = mypair[0]
-    offered = ""
-    for x in XSet:
-        if x[1]==j:
-            if offered == "": offered += BlockList[x[2]]
-            else: offered += "/" + BlockList[x[2]]
+    offered = "/".join(OfferedBlocks[j])
     
-    #if mypair[1] in StudentsPerGrade[12]: 
+    #if InGrade[12, mypair[1]]: 
     #    print("Grade 12 student", StudentList[mypair[1]], "missed", CourseList[mypair[0]], "offered in block", offered)
     
-    #if mypair[1] in StudentsPerGrade[11]: 
+    #if InGrade[11, mypair[1]]: 
     #    print("Grade 11 student", StudentList[mypair[1]], "missed", CourseList[mypair[0]], "offered in block", offered)
         
-    #if mypair[1] in StudentsPerGrade[10]: 
+    #if InGrade[10, mypair[1]]: 
     #    print("Grade 10 student", StudentList[mypair[1]], "missed", CourseList[mypair[0]], "offered in block", offered)
         
-    #if mypair[1] in StudentsPerGrade[9]: 
+    #if InGrade[9, mypair[1]]: 
     #    print("Grade 9 student", StudentList[mypair[1]], "missed", CourseList[mypair[0]], "offered in block", offered)
         
-    if mypair[1] in StudentsPerGrade[8]: 
+    if InGrade[8, mypair[1]]: 
         print("Grade 8 student", StudentList[mypair[1]], "missed", CourseList[mypair[0]], "offered in block", offered)
 
 # Use this code to double-check the enrollment numbers to ensure the multi-section
 # courses have roughly the same number of students.
 for j in range(m):
-    ycount = [0,0,0,0,0,0,0,0,0]
-    for k in [1,2,3,4,5,6,7,8,9]:
-        for y in YSet:
-            if y[1]==j and y[2]==k: ycount[k-1] += 1
+    ycount = Enrollment[j,1:].tolist()
     Missing = CourseRequestTotal[j] - sum(ycount)
     if CourseSections[j]==5:
         print(ycount, CourseList[j], "has", CourseRequestTotal[j], "enrolled students and",
               Missing, "unenrolled students")
 
 for j in IEPcourses:
-    ycount = [0,0,0,0,0,0,0,0,0]
-    for k in [1,2,3,4,5,6,7,8,9]:
-        for y in YSet:
-            if y[1] == j and y[2] == k:
-                if IEP[y[0]][j] == 1: ycount[k-1] += 1
+    ycount = IEPEnrollment[j,1:].tolist()
     if CourseSections[j]==4:
         print(ycount, CourseList[j], "has", sum(ycount), "IEP students split into", CourseSections[j], "sections")
 
 for j in range(m):
-    ycount = [[0,0],[0,0],[0,0],[0,0],[0,0],[0,0],[0,0],[0,0],[0,0]]
-    for k in [1,2,3,4,5,6,7,8,9]:
-        for y in YSet:
-            if y[1] == j and y[2] == k:
-                if GenderInfo[y[0]] == 1: ycount[k-1][1] += 1
-                if GenderInfo[y[0]] == 0: ycount[k-1][0] += 1
+    ycount = GenderEnrollment[j,1:].tolist()
     while [0,0] in ycount:
         ycount.remove([0,0])
     if CourseSections[j]>1 and CourseSections[j]<6:
@@ -829,10 +2001,7 @@ for x in range(len(XSet)):
     s = XSet[x][0]
     j = XSet[x][1]
     k = XSet[x][2]
-    count=0
-    for y in range(len(YSet)):
-        if YSet[y][1]==j and YSet[y][2]==k:
-            count+=1
+    count = int(Enrollment[j,k])
     
     M += [[CourseList[j], 'Section '+str(s), Blocks[k], count, 
            RoomLimit[j], RoomChoices[j], PossibleTeachers[j]]]
@@ -841,53 +2010,40 @@ FinalMatrix = pd.DataFrame(M, columns=OurColumns)
 FinalMatrix.to_csv("WPGA Optimal Timetable (Courses).csv", index = False)
 
 
-
 OurColumns = ["StudentID", "Student Grade", "Course Title", "Course Code", 
               "Preference", "Block"]
 
-Blocks = ["0", "1A", "1B", "1C", "1D", "2A", "2B", "2C", "2D", "2E"]
-M = []
-for x in range(len(InputInfo)):
-    Response = ""
-    i = StudentList.index(InputInfo[x][31])
-    j = CourseList.index(InputInfo[x][35]) 
-    if CourseSections[j] == 0:
-        Response = "Not Scheduled"
-    else:       
-        for y in YSet:
-            if y[0]==i and y[1]==j: 
-                Response = Blocks[y[2]]
-                
-    if Response == "":
-        Response = "FAIL"
-        
-    M += [[InputInfo[x][31], InputInfo[x][34], InputInfo[x][35], InputInfo[x][36],  
-          InputInfo[x][37], Response]]
-    
-FinalMatrix = pd.DataFrame(M, columns=OurColumns)
-FinalMatrix.to_csv("WPGA Optimal Timetable (Students).csv", index = False)
+# Look up the block of every row of the input file in Best.StudentBlock, all at once.  A request
+# that was not assigned (block 0) gets "FAIL", and a request for a course with no sections gets
+# "Not Scheduled".
+
+Blocks = ["FAIL", "1A", "1B", "1C", "1D", "2A", "2B", "2C", "2D", "2E"]
+Requests = pd.DataFrame(InputInfo).iloc[:, [31,34,35,36,37]]
+Requests.columns = OurColumns[:5]
+RequestStudents = Requests["StudentID"].map(StudentLookup).to_numpy()
+RequestCourses = Requests["Course Title"].map(CourseLookup).to_numpy()
+
+BlockNames = np.array(Blocks, dtype=object)
+FinalMatrix = Requests.copy()
+FinalMatrix["Block"] = BlockNames[Best.StudentBlock[RequestStudents, RequestCourses]]
+Cancelled = np.array(CourseSections)[RequestCourses] == 0
+FinalMatrix["Block"] = FinalMatrix["Block"].mask(Cancelled, "Not Scheduled")
+
+if Options.students_output.endswith(".parquet"):
+    FinalMatrix.to_parquet(Options.students_output, index = False)
+else:
+    FinalMatrix.to_csv(Options.students_output, index = False)
 
+BlockCourses = np.bincount(XArray[:,2], minlength=10)
 for k in [1,2,3,4,5,6,7,8,9]:
-    xcount=0
-    ycount=[0,0,0,0,0]
-    for x in XSet:
-        if x[2]==k:
-            xcount+=1
-    for y in YSet:
-        if y[2]==k:
-            if y[0] in StudentsPerGrade[8]: ycount[0]+=1
-            if y[0] in StudentsPerGrade[9]: ycount[1]+=1
-            if y[0] in StudentsPerGrade[10]: ycount[2]+=1
-            if y[0] in StudentsPerGrade[11]: ycount[3]+=1
-            if y[0] in StudentsPerGrade[12]: ycount[4]+=1
+    xcount = int(BlockCourses[k])
+    ycount = GradeEnrollment[8:13,k].tolist()
     print("Block", BlockList[k], "has", ycount, "students enrolled in", xcount, "courses")
 
 for d in range(5):
+    DepartmentSections = XArray[np.isin(XArray[:,1], DepartmentCourses[d])]
+    DepartmentLoad = np.bincount(DepartmentSections[:,2], minlength=10)
     for k in range(10):
-        count = 0
-        for x in XSet:
-            if x[1] in DepartmentCourses[d]:
-                if x[2]==k: 
-                    count+=1
+        count = int(DepartmentLoad[k])
         if count>=5:
-            print("WARNING: department", Departments[d], "has", count, "courses offered in block", k)
\ No newline at end of file
+            print("WARNING: department", Departments[d], "has", count, "courses offered in block", k)
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+## Synthetic School Instances for the WPGA Timetabling Program
+"""
+
+# Generate a synthetic input workbook in the same column layout as "WPGA 2022-2023 Data.xlsx",
+# so that the timetabling program can be run with --input on schools of any size.
+#
+# The course rows come first: one row per course with its department, sections, teachers, block
+# requirement and room requirement.  Every row also holds one student request (student ID, IEP
+# flag, gender, grade, course title, course code and preference).  The teacher list and the room
+# list (with capacities) are stored in their own columns of the first rows.
+#
+# The timetabling program and its rules file refer to some courses and teachers of the 2022-2023
+# data by name, so every instance contains these FixedCourses and NamedTeachers.  The remaining
+# courses are random, and their sections, teachers and rooms are chosen so that a timetable always
+# exists: each teacher teaches at most 7 sections, each department limited by CONSTRAINT 7 has at
+# most 36 sections, and each room (or group of rooms) is used by at most 6 sections per room.
+#
+# Usage: python generate_instance.py --students 800 --courses 250 --output school.xlsx
+
+import math
+import argparse
+import numpy as np
+import pandas as pd
+
+Columns = ['Department', 'Course Title (all offered)', 'Code', 'Requests', 'Gender Bal',
+           'number of Sections', 'Teachers Available', "Exclusions (can't be at the same time)",
+           "Block Req't", 'Room Requirement', 'Unnamed: 10', 'Blocks', 'Unnamed: 12', 'Teachers',
+           'Teacher Type', '# blocks', 'Restrictions', 'Unnamed: 17', 'Room Name', 'Room Type',
+           'Capacity', 'Unnamed: 21', 'Unnamed: 22', 'General Restrictions', 'Unnamed: 24',
+           'Unnamed: 25', 'Unnamed: 26', 'Unnamed: 27', 'Unnamed: 28', 'Unnamed: 29', 'Unnamed: 30',
+           'Hoshino Student ID', 'IEP Flag', 'Gender', 'Student grade level', 'Title Translation',
+           'Course code Translation', 'Preference']
+
+# [Department, Course Name, Code, Sections, Teachers, Block Requirement, Room Requirement, Grades]
+
+FixedCourses = [
+    ['Art and Drama', 'Theatre Company 10, 11, 12', 'DRTC 10, 11, 12', 1, 'McAllister', '1A', 'J013', [10,11,12]],
+    ['Art and Drama', 'Visual Arts 9.', 'VART-9.', 1, 'Harms', None, 'J012', [9]],
+    ['Learning Support', 'Guided Study Block', 'GSTUDY', 5, 'ANY', None, 'General/215', [8,9,10]],
+    ['Learning Support', 'Study Block', 'STUDY', 9, None, None, None, [10,11,12]],
+    ['Learning Support', 'Study Block2', 'STUDY2', 9, None, None, None, [10,11,12]],
+    ['Learning Support', 'Supervised Support Block', 'SSB', 9, 'Green', None, 'Study1', [10,11,12]],
+    ['Mathematics', 'AP Calculus AB', 'APCAL12', 1, 'Ito', 'CALC 12, APCALA', '032E', [12]],
+    ['Mathematics', 'AP Calculus BC', 'APCAL12A', 1, 'Liu', 'APCAL12, CALC 12', 'General', [12]],
+    ['Mathematics', 'Calculus 12', 'CALC 12', 1, 'Lu', 'APCAL12A, APCAL', 'General', [12]],
+    ['Mathematics', 'Pre-Calculus 11', 'PREC 11', 5, 'Ito/Liu/Manning/McAdam/Seo', None,
+     '031E/032E/033E/034E', [11]],
+    ['Physical and Health Education', 'Active Living 11/12', 'ACLV 11/12', 5, 'PESTAFF',
+     '1B/2A/2B/1C/1D/2C/2D/2E', 'Gym4/Gym5', [11,12]],
+    ['Physical and Health Education', 'Active Living 11/12 - Individual Pursuits', 'ACLV 11/12 - IP',
+     1, 'PESTAFF', '2C/2D/2E', 'Gym1/Gym2/Gym3/Gym4/Gym5', [11,12]],
+    ['Physical and Health Education', 'Physical and Health Education 10', 'PHED 10', 3, 'PESTAFF',
+     '2B', 'Gym1/Gym2/Gym3/Gym4/Gym5', [10]],
+    ['Physical and Health Education', 'Physical and Health Education 8.', 'PHE-8.', 3, 'PESTAFF',
+     '1A/1B', 'Gym2/Gym3/Gym4/Gym5', [8]],
+    ['Physical and Health Education', 'Physical and Health Education 9.', 'PHE-9.', 3, 'PESTAFF',
+     '1A/1B', 'Gym2/Gym3/Gym4/Gym5', [9]],
+    ['Physical and Health Education', 'Varsity Sport PE 10-12', 'VARSITY', 4, 'PESTAFF', '2A',
+     'Gym1/Gym2/Gym3/Gym4/Gym5', [10,11,12]],
+    ['Science', 'Environmental Science 12', 'EVSC 12', 1, 'Seo', None, '200/201/204/206/208/210', [12]],
+    ['Science', 'Geology 12', 'GEOL 12', 1, 'Wittmann', None, '033E', [12]],
+    ['Science', 'Physics 12', 'PH 12', 2, 'Liu', None, '200/201/204/206/208/210/034E', [12]],
+    ['Science', 'Science 10x', 'SC 10x', 1, 'Jellema', None, '200/204/208/210', [10]],
+    ['Social Studies', 'Global Studies 11/12 Seminar', 'YSSC 11/12A', 1, 'Bendl, Boland', None,
+     'General', [11,12]],
+    ['Technology Education', 'Materials Design 8.', 'YIA 8.', 1, 'Pope', None, 'J022', [8]],
+]
+
+# Teachers named by the rules file or by FixedCourses.  Only the ones in FixedCourses teach
+# anything, so the blocks the rules forbid for the others never matter.
+
+NamedTeachers = ['Bendl', 'Boland', 'Elmer', 'GaringerD', 'Goddard', 'Green', 'Harding', 'Harms',
+                 'Ito', 'Jellema', 'Johnston', 'Liu', 'Logher', 'Lu', 'Manning', 'McAdam',
+                 'McAllister', 'McCauley', 'Penner-Tovey', 'Point', 'Pope', 'Seo', 'Wittmann']
+
+# Rooms named by FixedCourses, with their capacities.
+
+NamedRooms = [['13', 24], ['200', 24], ['201', 22], ['204', 22], ['206', 24], ['208', 22],
+              ['210', 16], ['215', 13], ['031E', 20], ['032E', 20], ['033E', 20], ['034E', 20],
+              ['Gym1', 24], ['Gym2', 24], ['Gym3', 24], ['Gym4', 24], ['Gym5', 24], ['J012', 22],
+              ['J013', 25], ['J022', 14], ['Study1', 12]]
+
+CappedDepartments = ["English", "Mathematics", "Languages", "Science", "Social Studies"]
+OtherDepartments = ["Art and Drama", "Music", "Information Technology", "Technology Education",
+                    "Career Education", "Outdoor Education"]
+
+MaxTeacherSections = 7
+MaxDepartmentSections = 36
+MaxRoomSections = 6
+ClassSize = 22
+
+
+def GenerateInstance(Students, Courses, Seed=0):
+
+    Generator = np.random.default_rng(Seed)
+    if Courses < len(FixedCourses) + 5:
+        raise ValueError("an instance needs at least %d courses" % (len(FixedCourses) + 5))
+
+    # Choose the grades and the popularity of every course, then the requests of every student:
+    # 8 or 9 distinct courses for their grade, ranked by preference.
+    CourseInfo = [list(Course) for Course in FixedCourses]
+    for c in range(Courses - len(FixedCourses)):
+        Grade = int(Generator.integers(8, 13))
+        if Grade >= 10 and Generator.random() < 0.4:
+            Grades = list(range(Grade, 13)) if Grade < 12 else [11, 12]
+        else:
+            Grades = [Grade]
+        Name = "Synthetic Course %03d" % (c+1)
+        CourseInfo.append([None, Name, "SYN-%03d" % (c+1), 0, None, None, None, Grades])
+    m = len(CourseInfo)
+    Popularity = Generator.lognormal(0, 0.75, m)
+
+    StudentGrades = Generator.integers(8, 13, Students)
+    StudentGenders = np.where(Generator.random(Students) < 0.5, "Male", "Female")
+    Requests = []
+    for i in range(Students):
+        Grade = int(StudentGrades[i])
+        Pool = [j for j in range(m) if Grade in CourseInfo[j][7]]
+        if len(Pool) < 9:
+            Pool = list(range(m))
+        Weights = Popularity[Pool] / Popularity[Pool].sum()
+        Choices = Generator.choice(Pool, size=int(Generator.integers(8, 10)), replace=False, p=Weights)
+        for Rank, j in enumerate(Choices):
+            Requests.append([i, int(j), Rank+1])
+    RequestTotal = np.bincount([j for [i,j,Rank] in Requests], minlength=m)
+
+    # Sections, departments, teachers, block requirements and rooms of the synthetic courses.
+    DepartmentLoad = {d: 0 for d in CappedDepartments}
+    for Course in FixedCourses:
+        if Course[0] in DepartmentLoad:
+            DepartmentLoad[Course[0]] += Course[3]
+
+    TeacherLoad = {}
+    RoomLoad = {}
+    RoomGroups = []
+    for j in range(len(FixedCourses), m):
+        Course = CourseInfo[j]
+        Sections = min(5, max(1, math.ceil(RequestTotal[j] / ClassSize)))
+        if Generator.random() < 0.05:
+            Sections = 0
+        Course[3] = Sections
+
+        Department = CappedDepartments[int(Generator.integers(len(CappedDepartments)))]
+        if Generator.random() < 0.3 or DepartmentLoad[Department] + Sections > MaxDepartmentSections:
+            Department = OtherDepartments[int(Generator.integers(len(OtherDepartments)))]
+        else:
+            DepartmentLoad[Department] += Sections
+        Course[0] = Department
+
+        if Generator.random() < 0.3:
+            Options = sorted(Generator.choice(max(2, len(TeacherLoad)), 2, replace=False))
+            Course[4] = "/".join("Teacher%03d" % (t+1) for t in Options)
+        else:
+            Available = [t for t in TeacherLoad if TeacherLoad[t] + Sections <= MaxTeacherSections]
+            Teacher = Available[0] if Available else "Teacher%03d" % (len(TeacherLoad)+1)
+            TeacherLoad[Teacher] = TeacherLoad.get(Teacher, 0) + Sections
+            Course[4] = Teacher
+
+        if Sections <= 3 and Generator.random() < 0.05:
+            Course[5] = '1A/1B/2A/2B'
+
+        Draw = Generator.random()
+        Course[6] = 'General'
+        if Draw < 0.4:
+            if not RoomGroups or sum(RoomLoad[Room] for Room in RoomGroups[-1]) + Sections > \
+                    MaxRoomSections * len(RoomGroups[-1]):
+                First = len(RoomLoad)
+                RoomGroups.append(["S%03d" % (First+r+1) for r in range(3)])
+                for Room in RoomGroups[-1]:
+                    RoomLoad[Room] = 0
+            Group = RoomGroups[-1]
+            Room = min(Group, key=lambda Room: RoomLoad[Room])
+            if Draw < 0.25 and RoomLoad[Room] + Sections <= MaxRoomSections:
+                Course[6] = Room
+                RoomLoad[Room] += Sections
+            elif Draw >= 0.25:
+                Course[6] = "/".join(Group)
+                for r in range(Sections):
+                    RoomLoad[min(Group, key=lambda Room: RoomLoad[Room])] += 1
+
+    TeacherList = NamedTeachers + ["Teacher%03d" % (t+1) for t in range(max(2, len(TeacherLoad)))]
+    RoomList = NamedRooms + [[Room, int(Generator.integers(18, 27))] for Room in sorted(RoomLoad)]
+
+    # Lay out the workbook: course rows first, then one request per row.
+    Order = sorted(range(len(Requests)), key=lambda r: (Requests[r][0], Requests[r][2]))
+    Rows = len(Requests)
+    if Rows < max(m, len(TeacherList), len(RoomList)):
+        raise ValueError("too few students for this many courses")
+
+    Data = {Column: [None] * Rows for Column in Columns}
+    for j, Course in enumerate(CourseInfo):
+        Data['Department'][j] = Course[0]
+        Data['Course Title (all offered)'][j] = Course[1]
+        Data['Code'][j] = Course[2]
+        Data['Requests'][j] = float(RequestTotal[j])
+        Data['number of Sections'][j] = float(Course[3])
+        Data['Teachers Available'][j] = Course[4]
+        Data["Block Req't"][j] = Course[5]
+        Data['Room Requirement'][j] = Course[6]
+    for t, Teacher in enumerate(TeacherList):
+        Data['Teachers'][t] = Teacher
+    for r, [Room, Capacity] in enumerate(RoomList):
+        Data['Room Name'][r] = Room
+        Data['Capacity'][r] = float(Capacity)
+    for Row, r in enumerate(Order):
+        [i, j, Rank] = Requests[r]
+        Data['Hoshino Student ID'][Row] = i+1
+        Data['IEP Flag'][Row] = 'X' if Generator.random() < 0.09 else None
+        Data['Gender'][Row] = StudentGenders[i]
+        Data['Student grade level'][Row] = "Grade %d" % StudentGrades[i]
+        Data['Title Translation'][Row] = CourseInfo[j][1]
+        Data['Course code Translation'][Row] = CourseInfo[j][2]
+        Data['Preference'][Row] = Rank
+
+    return pd.DataFrame(Data, columns=Columns)
+
+
+if __name__ == "__main__":
+    Parser = argparse.ArgumentParser(description="Generate a synthetic WPGA-style input workbook")
+    Parser.add_argument("--students", type=int, default=410, help="number of students")
+    Parser.add_argument("--courses", type=int, default=130, help="number of courses")
+    Parser.add_argument("--seed", type=int, default=0, help="seed for the random number generator")
+    Parser.add_argument("--output", required=True, help="the workbook to write")
+    Options = Parser.parse_args()
+
+    Instance = GenerateInstance(Options.students, Options.courses, Options.seed)
+    Instance.to_excel(Options.output, sheet_name="Data", index=False)
+    print("Wrote", Options.output, "with", Options.students, "students,", Options.courses,
+          "courses and", len(Instance), "requests")
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+## Benchmarks for the WPGA Timetabling Program
+"""
+
+# Run the timetabling program on synthetic schools of several sizes (and optionally on the
+# 2022-2023 data) and report the model-build time, solve time, peak memory and objective value of
+# each run.  Every run is a separate process in its own temporary directory, with --metrics-log
+# turned on; the times and model sizes are read back from its metrics log.
+#
+# Sizes are given as STUDENTSxCOURSES, and "school" stands for "WPGA 2022-2023 Data.xlsx".
+# Every run uses the rules in "WPGA 2022-2023 Rules.json" unless --rules is passed on.
+# Any option that this script does not know is passed on to the timetabling program.
+#
+# Usage: python run_benchmarks.py --sizes school,200x60,410x130 --iterations 2 -- --backend HIGHS
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from generate_instance import GenerateInstance
+
+Here = os.path.dirname(os.path.abspath(__file__))
+Program = os.path.join(Here, os.pardir, "(part_2)_balancing_classes_with_iep_and_gender_info.py")
+SchoolInput = os.path.join(Here, os.pardir, "WPGA 2022-2023 Data.xlsx")
+SchoolRules = os.path.join(Here, os.pardir, "WPGA 2022-2023 Rules.json")
+
+
+# Run the timetabling program on the workbook Input, or on the 2022-2023 data in WorkingDirectory
+# if Input is None, and collect the results of the run.
+
+def RunProgram(Input, Arguments, WorkingDirectory):
+    Command = [sys.executable, os.path.abspath(Program), "--metrics-log", "metrics.jsonl",
+               "--rules", os.path.abspath(SchoolRules)] + Arguments
+    if Input is not None:
+        Command += ["--input", Input]
+    Start = time.time()
+    Output = open(os.path.join(WorkingDirectory, "output.txt"), "w")
+    Process = subprocess.Popen(Command, cwd=WorkingDirectory, stdout=Output, stderr=subprocess.STDOUT)
+    _, ExitStatus, Usage = os.wait4(Process.pid, 0)
+    Output.close()
+    Result = {"exit_code": os.waitstatus_to_exitcode(ExitStatus),
+              "wall_seconds": round(time.time() - Start, 2),
+              "peak_rss_mb": round(Usage.ru_maxrss / 1024, 1)}
+
+    # Add up the build and solve phases from the metrics log.
+    Result.update({"build_seconds": 0.0, "solve_seconds": 0.0, "rows": 0, "cols": 0,
+                   "objective": None, "iterations": 0})
+    MetricsFile = os.path.join(WorkingDirectory, "metrics.jsonl")
+    if os.path.exists(MetricsFile):
+        for Line in open(MetricsFile):
+            Record = json.loads(Line)
+            if Record["event"] == "build":
+                Result["build_seconds"] += Record["seconds"]
+                if Record["rows"] > Result["rows"]:
+                    Result["rows"] = Record["rows"]
+                    Result["cols"] = Record["cols"]
+            if Record["event"] == "solve":
+                Result["solve_seconds"] += sum(Phase["seconds"] for Phase in Record["phases"]
+                                               if Phase["phase"] == "solve")
+            if Record["event"] == "iteration":
+                Result["objective"] = Record.get("best", Record["objective"])
+                Result["iterations"] = Record["iteration"]
+    Result["build_seconds"] = round(Result["build_seconds"], 2)
+    Result["solve_seconds"] = round(Result["solve_seconds"], 2)
+    return Result
+
+
+if __name__ == "__main__":
+    Parser = argparse.ArgumentParser(description="Benchmark the WPGA timetabling program")
+    Parser.add_argument("--sizes", default="200x60,410x130,800x250",
+                        help="comma-separated list of STUDENTSxCOURSES sizes, or \"school\"")
+    Parser.add_argument("--seed", type=int, default=0,
+                        help="seed for the synthetic instances and the timetabling program")
+    Parser.add_argument("--iterations", type=int, default=1, help="hill-climbing iterations per run")
+    Parser.add_argument("--fixed-number", type=int, default=10,
+                        help="course sections free to move in each iteration")
+    Parser.add_argument("--time-limit", type=float, default=120, help="time limit for each solve")
+    Parser.add_argument("--output", default="benchmark_results.jsonl",
+                        help="append the results to this file as JSON lines")
+    Parser.add_argument("--keep", action="store_true",
+                        help="keep the working directory of every run")
+    Options, Passthrough = Parser.parse_known_args()
+    Passthrough = [Argument for Argument in Passthrough if Argument != "--"]
+
+    Arguments = ["--iterations", str(Options.iterations), "--fixed-number", str(Options.fixed_number),
+                 "--time-limit", str(Options.time_limit), "--seed", str(Options.seed)] + Passthrough
+
+    print("%-12s %8s %8s %8s %8s %9s %9s %9s %10s %s" % ("size", "rows", "cols", "build s",
+          "solve s", "wall s", "peak MB", "objective", "iterations", "exit"))
+    for Size in Options.sizes.split(","):
+        WorkingDirectory = tempfile.mkdtemp(prefix="wpga-benchmark-")
+        if Size == "school":
+            Input = None
+            shutil.copy(SchoolInput, WorkingDirectory)
+        else:
+            Students, Courses = [int(Number) for Number in Size.split("x")]
+            Input = os.path.join(WorkingDirectory, "instance.xlsx")
+            GenerateInstance(Students, Courses, Options.seed).to_excel(Input, sheet_name="Data",
+                                                                       index=False)
+
+        Result = RunProgram(Input, Arguments, WorkingDirectory)
+        Result.update({"size": Size, "seed": Options.seed, "arguments": Arguments,
+                       "time": round(time.time(), 3)})
+        print("%-12s %8d %8d %8.2f %8.2f %9.2f %9.1f %9s %10d %d" % (Size, Result["rows"],
+              Result["cols"], Result["build_seconds"], Result["solve_seconds"], Result["wall_seconds"],
+              Result["peak_rss_mb"], Result["objective"], Result["iterations"], Result["exit_code"]))
+        sys.stdout.flush()
+
+        file = open(Options.output, 'a')
+        file.write(json.dumps(Result) + '\n')
+        file.close()
+        if Options.keep:
+            print("  kept", WorkingDirectory)
+        else:
+            shutil.rmtree(WorkingDirectory)